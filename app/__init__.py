@@ -4,14 +4,18 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_moment import Moment
 from flask_pagedown import PageDown
-from flask_sqlalchemy import SQLAlchemy
 
 from config import config
+from .cache import page_cache, fragment_cache
+from .metrics import metrics
+from .profiler import query_profiler
+from .render import render_cache
+from .replica import RoutingSQLAlchemy, replica
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 page_down = PageDown()
 
 login_manager = LoginManager()
@@ -27,8 +31,23 @@ def create_app(config_name):
     mail.init_app(app)
     moment.init_app(app)
     db.init_app(app)
+    replica.init_app(app)
     page_down.init_app(app)
     login_manager.init_app(app)
+    render_cache.init_app(app)
+    page_cache.init_app(app)
+    fragment_cache.init_app(app)
+    query_profiler.init_app(app)
+    metrics.init_app(app)
+
+    from .models import user_cache, last_seen_buffer, follow_graph
+    user_cache.init_app(app)
+    follow_graph.init_app(app)
+    last_seen_buffer.init_app(app)
+    from .email import email_queue
+    email_queue.init_app(app)
+    from .search import search_index
+    search_index.init_app(app)
 
     if app.config['SSL_REDIRECT']:
         from flask_sslify import SSLify
@@ -8,4 +8,6 @@ from . import (  # noqa:  F401
     posts,
     comments,
     errors,
+    export,
+    search,
 )
@@ -1,13 +1,134 @@
-from flask import g, jsonify
+import hashlib
+import hmac
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import g, jsonify, current_app
 from flask_httpauth import HTTPBasicAuth
 
 from . import api
 from .errors import unauthorized, forbidden
-from ..models import User
+from ..models import User, user_cache
+from ..replica import read_only, replica
 
 auth = HTTPBasicAuth()
 
 
+class CredentialCache:
+    def __init__(self, app=None):
+        self.ttl = 60
+        self.maxsize = 1024
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('FLASKY_API_AUTH_CACHE_TTL', 60)
+        self.maxsize = app.config.get('FLASKY_API_AUTH_CACHE_SIZE', 1024)
+        self.clear()
+
+    @staticmethod
+    def digest(*parts):
+        # 只保存以 SECRET_KEY 簽署的摘要，不保存明文密碼或權杖
+        return hmac.new(
+            current_app.config['SECRET_KEY'].encode('utf-8'),
+            '\0'.join(parts).encode('utf-8'),
+            hashlib.sha256,
+        ).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+
+        expires_at, user_id, password_hash = entry
+        user = user_cache.get(user_id)
+        # 密碼變更後摘要就不再有效
+        if user is None or user.password_hash != password_hash:
+            self.invalidate(key)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return user
+
+    def set(self, key, user, expires_at=None):
+        if self.ttl <= 0:
+            return
+
+        expires_at = min(expires_at or float('inf'), time.time() + self.ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, user.id, user.password_hash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def verify_token(self, token):
+        key = self.digest('token', token)
+        user = self.get(key)
+        if user is not None:
+            return user
+
+        user_id, expiration = User.load_auth_token(token)
+        if user_id is None:
+            return None
+        user = user_cache.get(user_id)
+        if user is not None:
+            self.set(key, user, expiration)
+        return user
+
+    def verify_password(self, email, password):
+        key = self.digest('password', email, password)
+        user = self.get(key)
+        if user is not None:
+            return user, True
+
+        with replica.primary():
+            user = User.query.filter_by(email=email).first()
+        if not user:
+            return None, False
+        if not user.verify_password(password):
+            return user, False
+        self.set(key, user)
+        return user, True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+credential_cache = CredentialCache()
+api.record_once(lambda state: credential_cache.init_app(state.app))
+
+
 @api.before_request
 @auth.login_required
 def before_request():
@@ -26,20 +147,24 @@ def verify_password(email_or_token, password):
         return False
 
     if not password:
-        g.current_user = User.verify_auth_token(email_or_token)
+        g.current_user = credential_cache.verify_token(email_or_token)
         g.token_used = True
         return g.current_user is not None
 
-    user = User.query.filter_by(email=email_or_token).first()
+    user, verified = credential_cache.verify_password(
+        email_or_token,
+        password,
+    )
     if not user:
         return False
 
     g.current_user = user
     g.token_used = False
-    return user.verify_password(password)
+    return verified
 
 
 @api.route('/tokens/', methods=['POST'])
+@read_only
 def get_token():
     if g.current_user.is_anonymous or g.token_used:
         return unauthorized('Invalid credentials')
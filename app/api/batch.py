@@ -0,0 +1,62 @@
+import json
+
+from flask import jsonify, request, current_app
+
+from .errors import payload_too_large
+from .. import db
+from ..exceptions import ValidationError
+
+
+def create_batch(build):
+    max_bytes = current_app.config['FLASKY_API_BATCH_MAX_BYTES']
+    if (request.content_length or 0) > max_bytes:
+        return payload_too_large(f'batch payload exceeds {max_bytes} bytes')
+    # chunked 或沒有 Content-Length 的請求，以實際讀取的位元組數為準
+    data = request.stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        return payload_too_large(f'batch payload exceeds {max_bytes} bytes')
+
+    try:
+        items = json.loads(data) if request.is_json else None
+    except ValueError:
+        raise ValidationError('batch is not valid JSON')
+    if not isinstance(items, list) or not items:
+        raise ValidationError('batch must be a non-empty list')
+    max_items = current_app.config['FLASKY_API_BATCH_SIZE']
+    if len(items) > max_items:
+        return payload_too_large(f'batch exceeds {max_items} items')
+
+    # 逐項驗證，有問題的項目不影響其他項目
+    results = []
+    created = []
+    for item in items:
+        try:
+            if not isinstance(item, dict):
+                raise ValidationError('item must be an object')
+            instance = build(item)
+        except ValidationError as e:
+            results.append({
+                'status': 400,
+                'error': 'bad request',
+                'message': e.args[0],
+            })
+        else:
+            results.append(instance)
+            created.append(instance)
+
+    # 所有有效的項目在同一個交易中寫入
+    if created:
+        db.session.add_all(created)
+        db.session.commit()
+
+    return jsonify({
+        'results': [
+            result if isinstance(result, dict) else {
+                'status': 201,
+                'item': result.to_json(),
+            }
+            for result in results
+        ],
+        'created': len(created),
+        'failed': len(items) - len(created),
+    }), 201 if len(created) == len(items) else 207
@@ -1,65 +1,60 @@
 from flask import jsonify, request, g, url_for, current_app
 
 from . import api
+from .batch import create_batch
+from .conditional import conditional, resource_version, collection_version
 from .decorators import permission_required
+from .multiget import parse_ids, multi_get
+from .pagination import paginate
 from .. import db
 from ..models import Post, Permission, Comment
 
 
 @api.route('/comments/')
+@conditional(lambda: collection_version('comments'))
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page,
+    ids = parse_ids()
+    if ids is not None:
+        return multi_get(Comment, ids)
+
+    comments, prev, next, count = paginate(
+        Comment.query,
+        Comment,
+        'api.get_comments',
         per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False,
     )
-    comments = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page - 1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page + 1)
-
     return jsonify({
         'comments': [comment.to_json() for comment in comments],
         'prev': prev,
         'next': next,
-        'count': pagination.total,
+        'count': count,
     })
 
 
 @api.route('/comments/<int:id>')
+@conditional(lambda id: resource_version(Comment, id))
 def get_comment(id):
     comment = Comment.query.get_or_404(id)
     return jsonify(comment.to_json())
 
 
 @api.route('/posts/<int:id>/comments/')
+@conditional(lambda id: collection_version('posts', 'comments'))
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page,
+    comments, prev, next, count = paginate(
+        post.comments,
+        Comment,
+        'api.get_post_comments',
         per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
-        error_out=False,
+        ascending=True,
+        id=id,
     )
-    comments = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_post_comments', id=id, page=page - 1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_post_comments', id=id, page=page + 1)
-
     return jsonify({
         'comments': [comment.to_json() for comment in comments],
         'prev': prev,
         'next': next,
-        'count': pagination.total,
+        'count': count,
     })
 
 
@@ -77,3 +72,17 @@ def new_post_comment(id):
         201,
         {'Location': url_for('api.get_comment', id=comment.id)},
     )
+
+
+@api.route('/posts/<int:id>/comments/batch', methods=['POST'])
+@permission_required(Permission.COMMENT)
+def new_post_comments(id):
+    post = Post.query.get_or_404(id)
+
+    def build(json_comment):
+        comment = Comment.from_json(json_comment)
+        comment.author = g.current_user
+        comment.post = post
+        return comment
+
+    return create_batch(build)
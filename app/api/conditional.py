@@ -0,0 +1,56 @@
+import hashlib
+from functools import wraps
+
+from flask import abort, current_app, request, make_response
+
+from .. import db
+from ..models import TableVersion
+
+
+def make_etag(*parts):
+    return hashlib.md5(
+        '\0'.join(str(part) for part in parts).encode('utf-8'),
+    ).hexdigest()
+
+
+def resource_version(model, id):
+    # 只查詢 updated_at，不需要載入整筆資料
+    row = db.session.query(model.updated_at).filter(model.id == id).first()
+    if row is None:
+        abort(404)
+    updated_at = row[0]
+    return make_etag(model.__tablename__, id, updated_at), updated_at
+
+
+def collection_version(*tables):
+    # 只讀取資料表的版本列，不必掃描整個清單
+    versions, updated_at = TableVersion.current(*tables)
+    return make_etag(request.full_path, *versions), updated_at
+
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        since = request.if_modified_since.replace(tzinfo=None)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def conditional(version):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            etag, last_modified = version(*args, **kwargs)
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            return response
+
+        return decorated_function
+
+    return decorator
@@ -22,6 +22,12 @@ def forbidden(message):
     return response
 
 
+def payload_too_large(message):
+    response = jsonify({'error': 'payload too large', 'message': message})
+    response.status_code = 413
+    return response
+
+
 @api.errorhandler(ValidationError)
 def validation_error(error):
     return bad_request(error.args[0])
@@ -0,0 +1,21 @@
+from flask import request, current_app, stream_with_context
+
+from . import api
+from .decorators import permission_required
+from ..export import export_query, export_rows
+from ..models import Permission
+
+
+@api.route('/export/<name>')
+@permission_required(Permission.ADMIN)
+def export(name):
+    query = export_query(
+        name,
+        since_id=request.args.get('since_id', type=int),
+        start=request.args.get('start'),
+        end=request.args.get('end'),
+    )
+    return current_app.response_class(
+        stream_with_context(export_rows(query)),
+        mimetype='application/x-ndjson',
+    )
@@ -0,0 +1,34 @@
+from flask import jsonify, request, current_app
+
+from ..exceptions import ValidationError
+
+
+def parse_ids():
+    ids = request.args.get('ids')
+    if ids is None:
+        return None
+    try:
+        ids = [int(id) for id in ids.split(',') if id.strip()]
+    except ValueError:
+        raise ValidationError('ids must be a comma separated list of integers')
+    max_ids = current_app.config['FLASKY_API_MULTI_GET_SIZE']
+    if not ids or len(ids) > max_ids:
+        raise ValidationError(f'ids must contain 1 to {max_ids} items')
+    # 保留請求的順序，重複的 id 只查一次
+    return list(dict.fromkeys(ids))
+
+
+def multi_get(model, ids):
+    # 整組 id 以一次 IN 查詢取回，找不到的 id 逐項回報
+    items = {item.id: item for item in model.query.filter(model.id.in_(ids))}
+    results = []
+    for id in ids:
+        item = items.get(id)
+        if item is None:
+            results.append({'id': id, 'status': 404, 'error': 'not found'})
+        else:
+            results.append({'id': id, 'status': 200, 'item': item.to_json()})
+    return jsonify({
+        'results': results,
+        'missing': [id for id in ids if id not in items],
+    })
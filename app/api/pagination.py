@@ -0,0 +1,109 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import request, url_for
+
+from .. import db
+from ..exceptions import ValidationError
+
+
+def encode_cursor(item, forward, count):
+    data = [item.timestamp.isoformat(), item.id, int(forward), count]
+    return urlsafe_b64encode(json.dumps(data).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, id, forward, count = json.loads(
+            urlsafe_b64decode(cursor.encode('utf-8')),
+        )
+        return datetime.fromisoformat(timestamp), int(id), bool(forward), count
+    except Exception:
+        raise ValidationError('invalid cursor')
+
+
+def paginate(query, model, endpoint, per_page, ascending=False, keys=None,
+             **kwargs):
+    # keys 是排序用的 (時間, id) 欄位，預設為 model 本身的欄位
+    timestamp_key, id_key = keys or (model.timestamp, model.id)
+
+    # 舊的客戶端仍可用 ?page= 分頁
+    if 'page' in request.args and 'cursor' not in request.args:
+        return offset_paginate(
+            query,
+            (timestamp_key, id_key),
+            endpoint,
+            per_page,
+            ascending,
+            **kwargs,
+        )
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        timestamp, id, forward, count = decode_cursor(cursor)
+        # 往後翻頁時取排序在後面的資料，往前翻頁則反向查詢後再倒轉
+        if ascending == forward:
+            query = query.filter(db.or_(
+                timestamp_key > timestamp,
+                db.and_(timestamp_key == timestamp, id_key > id),
+            ))
+        else:
+            query = query.filter(db.or_(
+                timestamp_key < timestamp,
+                db.and_(timestamp_key == timestamp, id_key < id),
+            ))
+    else:
+        forward = True
+        # 總數只在第一頁計算，之後隨著游標傳遞
+        count = query.order_by(None).count()
+
+    if ascending == forward:
+        order = (timestamp_key.asc(), id_key.asc())
+    else:
+        order = (timestamp_key.desc(), id_key.desc())
+    items = query.order_by(*order).limit(per_page + 1).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if forward:
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        items.reverse()
+        has_prev, has_next = has_more, True
+
+    prev = None
+    if has_prev and items:
+        prev = url_for(
+            endpoint,
+            cursor=encode_cursor(items[0], False, count),
+            **kwargs,
+        )
+    next = None
+    if has_next and items:
+        next = url_for(
+            endpoint,
+            cursor=encode_cursor(items[-1], True, count),
+            **kwargs,
+        )
+    return items, prev, next, count
+
+
+def offset_paginate(query, keys, endpoint, per_page, ascending, **kwargs):
+    if ascending:
+        order = tuple(key.asc() for key in keys)
+    else:
+        order = tuple(key.desc() for key in keys)
+    page = request.args.get('page', 1, type=int)
+    pagination = query.order_by(*order).paginate(
+        page,
+        per_page=per_page,
+        error_out=False,
+    )
+
+    prev = None
+    if pagination.has_prev:
+        prev = url_for(endpoint, page=page - 1, **kwargs)
+    next = None
+    if pagination.has_next:
+        next = url_for(endpoint, page=page + 1, **kwargs)
+    return pagination.items, prev, next, pagination.total
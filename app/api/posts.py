@@ -1,38 +1,39 @@
 from flask import jsonify, request, g, url_for, current_app
 
 from . import api
+from .batch import create_batch
+from .conditional import conditional, resource_version, collection_version
 from .decorators import permission_required
 from .errors import forbidden
+from .multiget import parse_ids, multi_get
+from .pagination import paginate
 from .. import db
 from ..models import Post, Permission
 
 
 @api.route('/posts/')
+@conditional(lambda: collection_version('posts'))
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-        page,
+    ids = parse_ids()
+    if ids is not None:
+        return multi_get(Post, ids)
+
+    posts, prev, next, count = paginate(
+        Post.query,
+        Post,
+        'api.get_posts',
         per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False,
     )
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page - 1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page + 1)
-
     return jsonify({
         'posts': [post.to_json() for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total,
+        'count': count,
     })
 
 
 @api.route('/posts/<int:id>')
+@conditional(lambda id: resource_version(Post, id))
 def get_post(id):
     post = Post.query.get_or_404(id)
     return jsonify(post.to_json())
@@ -52,6 +53,17 @@ def new_post():
     )
 
 
+@api.route('/posts/batch', methods=['POST'])
+@permission_required(Permission.WRITE)
+def new_posts():
+    def build(json_post):
+        post = Post.from_json(json_post)
+        post.author = g.current_user
+        return post
+
+    return create_batch(build)
+
+
 @api.route('/posts/<int:id>', methods=['PUT'])
 @permission_required(Permission.WRITE)
 def edit_post(id):
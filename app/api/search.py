@@ -0,0 +1,33 @@
+from flask import jsonify, request, url_for, current_app
+
+from . import api
+from .. import db
+from ..models import Post, Comment
+from ..search import search_index
+
+
+@api.route('/search/<any(posts, comments):kind>')
+def search(kind):
+    model = Post if kind == 'posts' else Comment
+    q = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    pagination = search_index.search(
+        model,
+        q,
+        page=page,
+        per_page=current_app.config['FLASKY_SEARCH_RESULTS_PER_PAGE'],
+        query=model.query.options(db.joinedload(model.author)),
+    )
+
+    prev = None
+    if pagination.has_prev:
+        prev = url_for('api.search', kind=kind, q=q, page=page - 1)
+    next = None
+    if pagination.has_next:
+        next = url_for('api.search', kind=kind, q=q, page=page + 1)
+    return jsonify({
+        kind: [item.to_json() for item in pagination.items],
+        'prev': prev,
+        'next': next,
+        'count': pagination.total,
+    })
@@ -1,62 +1,69 @@
-from flask import jsonify, request, current_app, url_for
+from flask import jsonify, current_app
 
 from . import api
+from .conditional import conditional, resource_version, collection_version
+from .multiget import parse_ids, multi_get
+from .pagination import paginate
+from ..exceptions import ValidationError
 from ..models import User, Post
 
 
+@api.route('/users/')
+@conditional(lambda: collection_version('users'))
+def get_users():
+    ids = parse_ids()
+    if ids is None:
+        raise ValidationError('ids is required')
+    return multi_get(User, ids)
+
+
 @api.route('/users/<int:id>')
+@conditional(lambda id: resource_version(User, id))
 def get_user(id):
     user = User.query.get_or_404(id)
     return jsonify(user.to_json())
 
 
 @api.route('/users/<int:id>/posts/')
+@conditional(lambda id: collection_version('users', 'posts'))
 def get_user_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        page,
+    posts, prev, next, count = paginate(
+        user.posts,
+        Post,
+        'api.get_user_posts',
         per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False,
+        id=id,
     )
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_posts', id=id, page=page - 1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_posts', id=id, page=page + 1)
-
     return jsonify({
         'posts': [post.to_json() for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total,
+        'count': count,
     })
 
 
 @api.route('/users/<int:id>/timeline/')
+@conditional(lambda id: collection_version(
+    'users',
+    'posts',
+    'follows',
+    'timelines',
+))
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page,
+    query, keys = user.timeline()
+    posts, prev, next, count = paginate(
+        query,
+        Post,
+        'api.get_user_followed_posts',
         per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
-        error_out=False,
+        keys=keys,
+        id=id,
     )
-    posts = pagination.items
-
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_user_followed_posts', id=id, page=page - 1)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_user_followed_posts', id=id, page=page + 1)
-
     return jsonify({
         'posts': [post.to_json() for post in posts],
         'prev': prev,
         'next': next,
-        'count': pagination.total,
+        'count': count,
     })
@@ -13,6 +13,7 @@ from .forms import (
 from .. import db
 from ..email import send_email
 from ..models import User
+from ..replica import read_write
 
 
 @auth.before_app_request
@@ -77,6 +78,7 @@ def register():
 
 
 @auth.route('/confirm/<token>')
+@read_write
 @login_required
 def confirm(token):
     if current_user.confirmed:
@@ -196,6 +198,7 @@ def change_email_request():
 
 
 @auth.route('/change_email/<token>')
+@read_write
 @login_required
 def change_email(token):
     if current_user.change_email(token):
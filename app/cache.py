@@ -0,0 +1,298 @@
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from flask import request, session, current_app, make_response
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy.orm import object_session
+
+from .replica import replica
+
+
+class PageCache:
+    def __init__(self, app=None):
+        self.directory = None
+        self.ttl = 60
+        self.maxsize = 1000
+        self.lock_timeout = 10
+        self._entries = OrderedDict()
+        self._generation = uuid.uuid4().hex
+        self._locks = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('FLASKY_PAGE_CACHE_DIR')
+        self.ttl = app.config.get('FLASKY_PAGE_CACHE_TTL', 60)
+        self.maxsize = app.config.get('FLASKY_PAGE_CACHE_SIZE', 1000)
+        self.lock_timeout = app.config.get(
+            'FLASKY_PAGE_CACHE_LOCK_TIMEOUT',
+            10,
+        )
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.invalidate()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write(self, path, data):
+        # 先寫暫存檔再替換，其他 worker 不會讀到寫一半的檔案
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def generation(self):
+        if not self.directory:
+            return self._generation
+        try:
+            with open(self._path('generation')) as f:
+                return f.read()
+        except OSError:
+            return ''
+
+    def invalidate(self, *args):
+        # 換一個新的世代，舊的快取項目自然失效
+        generation = uuid.uuid4().hex
+        if self.directory:
+            self._write(self._path('generation'), generation)
+            for path in glob.glob(self._path('page-*.json')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        else:
+            with self._lock:
+                self._generation = generation
+                self._entries.clear()
+
+    def on_change(self, mapper, connection, target):
+        # flush 時只記下有變動，等交易提交後才失效，
+        # 避免其他請求在提交前重新產生並快取舊的頁面
+        session = object_session(target)
+        if session is not None:
+            session.info['page_cache_changed'] = True
+
+    def on_commit(self, session):
+        if session.info.pop('page_cache_changed', False):
+            self.invalidate()
+
+    def on_rollback(self, session):
+        session.info.pop('page_cache_changed', None)
+
+    def key(self):
+        # 只依頁碼區分，任意的查詢參數不會產生新的快取項目
+        page = request.args.get('page', 1, type=int)
+        return hashlib.sha1(
+            f'{self.generation()}:{request.endpoint}:{request.path}:{page}'
+            .encode('utf-8'),
+        ).hexdigest()
+
+    def get(self, key):
+        if self.directory:
+            try:
+                with open(self._path(f'page-{key}.json')) as f:
+                    page = json.load(f)
+            except (OSError, ValueError):
+                return None
+        else:
+            with self._lock:
+                page = self._entries.get(key)
+                if page is not None:
+                    self._entries.move_to_end(key)
+        if page is None or page['expires'] < time.time():
+            return None
+        return page
+
+    def set(self, key, page):
+        page['expires'] = time.time() + self.ttl
+        if self.directory:
+            self._write(self._path(f'page-{key}.json'), json.dumps(page))
+            self._prune()
+            return
+        with self._lock:
+            self._entries[key] = page
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _prune(self):
+        paths = glob.glob(self._path('page-*.json'))
+        if len(paths) <= self.maxsize:
+            return
+        # 依寫入時間由舊到新移除，過期的檔案一併清掉
+        entries = []
+        for path in paths:
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+        entries.sort()
+        excess = len(entries) - self.maxsize
+        expired = time.time() - self.ttl
+        for mtime, path in entries:
+            if excess <= 0 and mtime >= expired:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            excess -= 1
+
+    def acquire(self, key):
+        if not self.directory:
+            with self._lock:
+                lock = self._locks.setdefault(key, Lock())
+            return lock.acquire(blocking=False)
+
+        path = self._path(f'lock-{key}')
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL))
+            return True
+        except FileExistsError:
+            pass
+        # 取得鎖的 worker 可能已經結束，過期的鎖直接移除再試一次
+        try:
+            if time.time() - os.path.getmtime(path) > self.lock_timeout:
+                os.remove(path)
+                return self.acquire(key)
+        except OSError:
+            pass
+        return False
+
+    def release(self, key):
+        if not self.directory:
+            with self._lock:
+                lock = self._locks.pop(key, None)
+            if lock is not None:
+                lock.release()
+            return
+        try:
+            os.remove(self._path(f'lock-{key}'))
+        except OSError:
+            pass
+
+    def wait(self, key):
+        # 持有鎖的請求一結束就停止等待，它沒有存入頁面時
+        # （例如 404 或發生例外）不必等到逾時
+        if not self.directory:
+            with self._lock:
+                lock = self._locks.get(key)
+            if lock is not None and lock.acquire(timeout=self.lock_timeout):
+                lock.release()
+            return self.get(key)
+
+        path = self._path(f'lock-{key}')
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline and os.path.exists(path):
+            time.sleep(0.05)
+            page = self.get(key)
+            if page is not None:
+                return page
+        return self.get(key)
+
+    def cacheable(self):
+        return self.ttl > 0 and request.method == 'GET' and \
+            current_user.is_anonymous and not session.get('_flashes')
+
+    def cached(self, f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self.cacheable():
+                return f(*args, **kwargs)
+
+            key = self.key()
+            page = self.get(key)
+            if page is None:
+                # 只讓一個請求重新產生頁面，其他請求等待它的結果
+                if self.acquire(key):
+                    try:
+                        # 要快取的頁面從主資料庫產生，副本只服務未快取的讀取
+                        with replica.primary():
+                            response = make_response(f(*args, **kwargs))
+                        if response.status_code == 200:
+                            self.set(key, {
+                                'data': response.get_data(as_text=True),
+                                'mimetype': response.mimetype,
+                            })
+                        return response
+                    finally:
+                        self.release(key)
+
+                page = self.wait(key)
+                if page is None:
+                    return f(*args, **kwargs)
+
+            return current_app.response_class(
+                page['data'],
+                mimetype=page['mimetype'],
+            )
+
+        return decorated_function
+
+
+class FragmentCache:
+    def __init__(self, app=None, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('FLASKY_FRAGMENT_CACHE_SIZE', 10000)
+        self.clear()
+        app.add_template_global(self.fragment, 'cached_fragment')
+
+    def fragment(self, *key, caller):
+        # 在樣板中以 {% call cached_fragment(...) %} 包住不隨瀏覽者改變的區塊，
+        # key 需包含項目的版本，內容變動時自然產生新的項目
+        key = ':'.join(str(part) for part in key)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return Markup(html)
+            self.misses += 1
+
+        html = caller()
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = str(html)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return Markup(html)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+page_cache = PageCache()
+fragment_cache = FragmentCache()
@@ -1,4 +1,8 @@
-from threading import Thread
+import atexit
+import queue
+import smtplib
+import time
+from threading import Lock, Thread
 
 from flask import render_template, current_app
 from flask_mail import Message
@@ -6,9 +10,140 @@ from flask_mail import Message
 from . import mail
 
 
-def async_send_email(app, message):
-    with app.app_context():
-        mail.send(message)
+class EmailQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 2
+        self.idle_timeout = 30
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = Lock()
+        self._stats = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.app is None:
+            atexit.register(self.shutdown)
+        else:
+            self.shutdown()
+        self.app = app
+        self.workers = app.config.get('FLASKY_MAIL_WORKERS', 2)
+        self.idle_timeout = app.config.get('FLASKY_MAIL_IDLE_TIMEOUT', 30)
+        self._queue = queue.Queue(app.config.get('FLASKY_MAIL_QUEUE_SIZE', 0))
+        self._threads = []
+        self._stats = {
+            'sent': 0,
+            'failed': 0,
+            'connections': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0,
+        }
+
+    def enqueue(self, message):
+        with self._lock:
+            if not self._threads:
+                for i in range(self.workers):
+                    thread = Thread(
+                        target=self._work,
+                        name=f'email-worker-{i}',
+                        daemon=True,
+                    )
+                    thread.start()
+                    self._threads.append(thread)
+        # 佇列滿了就阻塞呼叫端，避免無限制地累積
+        self._queue.put((time.monotonic(), message))
+
+    def _connect(self):
+        connection = mail.connect()
+        connection.__enter__()
+        with self._lock:
+            self._stats['connections'] += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    def _send(self, connection, message):
+        # 連線可能已被伺服器關閉，失敗時重新連線再試一次
+        for _ in range(2):
+            try:
+                if connection is None:
+                    connection = self._connect()
+                connection.send(message)
+                return connection, True
+            except (smtplib.SMTPException, OSError):
+                current_app.logger.exception('Failed to send email')
+                if connection is not None:
+                    self._close(connection)
+                connection = None
+        return connection, False
+
+    def _work(self):
+        with self.app.app_context():
+            connection = None
+            while True:
+                try:
+                    item = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    # 閒置太久就釋放 SMTP 連線
+                    if connection is not None:
+                        self._close(connection)
+                        connection = None
+                    continue
+
+                if item is None:
+                    if connection is not None:
+                        self._close(connection)
+                    self._queue.task_done()
+                    return
+
+                queued_at, message = item
+                try:
+                    connection, sent = self._send(connection, message)
+                except Exception:
+                    # 訊息本身有問題時只算這封失敗，worker 繼續處理下一封
+                    current_app.logger.exception('Failed to send email')
+                    sent = False
+                finally:
+                    self._queue.task_done()
+                latency = time.monotonic() - queued_at
+                with self._lock:
+                    self._stats['sent' if sent else 'failed'] += 1
+                    self._stats['latency_total'] += latency
+                    self._stats['latency_max'] = max(
+                        self._stats['latency_max'],
+                        latency,
+                    )
+
+    def drain(self):
+        self._queue.join()
+
+    def shutdown(self):
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            workers = len(self._threads)
+        processed = stats['sent'] + stats['failed']
+        latency_total = stats.pop('latency_total')
+        stats['latency_avg'] = latency_total / processed if processed else 0.0
+        stats['queue_depth'] = self._queue.qsize()
+        stats['workers'] = workers
+        return stats
+
+
+email_queue = EmailQueue()
 
 
 def send_email(to, subject, template, **kwargs):
@@ -21,6 +156,4 @@ def send_email(to, subject, template, **kwargs):
     message.body = render_template(template + '.txt', **kwargs)
     message.html = render_template(template + '.html', **kwargs)
 
-    thread = Thread(target=async_send_email, args=[app, message])
-    thread.start()
-    return thread
+    email_queue.enqueue(message)
@@ -0,0 +1,67 @@
+from . import db
+from .models import Follow, Post, Comment, Timeline
+
+# 熱門查詢與預期 planner 會使用的索引
+HOT_QUERIES = {
+    'user posts': (
+        lambda: Post.query.filter(Post.author_id == 1)
+        .order_by(Post.timestamp.desc()),
+        'ix_posts_author_id_timestamp',
+    ),
+    'timeline': (
+        lambda: Post.query.join(Timeline, Timeline.post_id == Post.id)
+        .filter(Timeline.user_id == 1)
+        .order_by(Timeline.timestamp.desc(), Timeline.post_id.desc()),
+        'ix_timelines_user_id_timestamp_post_id',
+    ),
+    'post comments': (
+        lambda: Comment.query.filter(Comment.post_id == 1)
+        .order_by(Comment.timestamp.asc()),
+        'ix_comments_post_id_timestamp',
+    ),
+    # 追隨者列表與發文時推送時間軸都以 followed_id 查詢
+    'followers': (
+        lambda: Follow.query.filter(Follow.followed_id == 1),
+        'ix_follows_followed_id',
+    ),
+    'moderation': (
+        lambda: Comment.query.order_by(Comment.timestamp.desc()),
+        'ix_comments_timestamp',
+    ),
+}
+
+
+def explain(query):
+    # 在獨立的連線與交易中執行，不影響呼叫者 session 中尚未提交的內容
+    with db.engine.connect() as connection:
+        dialect = connection.dialect
+        if dialect.name not in ('sqlite', 'postgresql'):
+            return None
+        sql = str(query.statement.compile(
+            dialect=dialect,
+            compile_kwargs={'literal_binds': True},
+        ))
+        transaction = connection.begin()
+        try:
+            if dialect.name == 'sqlite':
+                rows = connection.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return '\n'.join(row[-1] for row in rows)
+            # 資料表很小時 planner 會直接循序掃描，關掉它才看得出索引能否使用
+            connection.execute('SET LOCAL enable_seqscan = off')
+            rows = connection.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in rows)
+        finally:
+            transaction.rollback()
+
+
+def check_indexes():
+    # 不支援 EXPLAIN 的資料庫，used 為 None
+    results = {}
+    for name, (build, index) in HOT_QUERIES.items():
+        plan = explain(build())
+        results[name] = {
+            'index': index,
+            'used': None if plan is None else index in plan,
+            'plan': plan,
+        }
+    return results
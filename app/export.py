@@ -0,0 +1,80 @@
+import json
+from datetime import datetime
+
+from flask import current_app
+
+from .exceptions import ValidationError
+from .models import User, Post, Comment
+
+# 每種資料匯出的欄位與用來篩選時間範圍的欄位
+EXPORTS = {
+    'users': (User, User.member_since, (
+        User.id,
+        User.username,
+        User.role_id,
+        User.confirmed,
+        User.name,
+        User.location,
+        User.about_me,
+        User.member_since,
+        User.last_seen,
+    )),
+    'posts': (Post, Post.timestamp, (
+        Post.id,
+        Post.author_id,
+        Post.body,
+        Post.timestamp,
+        Post.updated_at,
+    )),
+    'comments': (Comment, Comment.timestamp, (
+        Comment.id,
+        Comment.post_id,
+        Comment.author_id,
+        Comment.body,
+        Comment.disabled,
+        Comment.timestamp,
+        Comment.updated_at,
+    )),
+}
+
+
+def parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValidationError(f'invalid timestamp: {value}')
+
+
+def export_query(name, since_id=None, start=None, end=None):
+    if name not in EXPORTS:
+        raise ValidationError(f'unknown export: {name}')
+    model, timestamp, columns = EXPORTS[name]
+
+    # 依 id 排序，中斷後可用最後一筆的 id 作為 since_id 接續
+    query = model.query.with_entities(*columns).order_by(model.id.asc())
+    if since_id is not None:
+        query = query.filter(model.id > since_id)
+    start = parse_timestamp(start)
+    if start is not None:
+        query = query.filter(timestamp >= start)
+    end = parse_timestamp(end)
+    if end is not None:
+        query = query.filter(timestamp < end)
+    return query
+
+
+def export_rows(query, batch_size=None):
+    if batch_size is None:
+        batch_size = current_app.config['FLASKY_EXPORT_BATCH_SIZE']
+    # 分批取回資料列，記憶體用量不隨資料表大小增加
+    for row in query.yield_per(batch_size):
+        yield json.dumps(
+            {
+                key: value.isoformat() if isinstance(value, datetime)
+                else value
+                for key, value in zip(row.keys(), row)
+            },
+            ensure_ascii=False,
+        ) + '\n'
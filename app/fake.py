@@ -1,43 +1,368 @@
-from random import randint
+import hashlib
+import os
+import random
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 
 from faker import Faker
-from sqlalchemy.exc import IntegrityError
+from flask import current_app
+from werkzeug.security import generate_password_hash
 
 from . import db
-from .models import User, Post
-
-
-def users(count=100):
-    faker = Faker()
-    i = 0
-    while i < count:
-        user = User(
-            email=faker.email(),
-            username=faker.user_name(),
-            password='password',
-            confirmed=True,
-            name=faker.name(),
-            location=faker.city(),
-            about_me=faker.text(),
-            member_since=faker.past_date(),
+from .cache import page_cache
+from .models import (
+    Role, User, Follow, Post, Comment, Timeline, follow_graph,
+)
+from .render import renderers
+from .search import search_index
+
+BATCH_SIZE = 10000
+# 指定 seed 時所有時間都從這個時間點往回產生，資料才能重現
+EPOCH = datetime(2020, 1, 1)
+
+
+def render_bodies(profile, bodies):
+    # 在子行程中執行，只使用不帶快取的 Renderer
+    renderer = renderers[profile]
+    return [renderer.render(body) for body in bodies]
+
+
+class Generator:
+    def __init__(self, seed=None, workers=None, batch_size=BATCH_SIZE,
+                 now=None):
+        self.random = random.Random(seed)
+        self.faker = Faker()
+        if seed is not None:
+            self.faker.seed_instance(seed)
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        if now is None:
+            now = EPOCH if seed is not None else datetime.utcnow()
+        self.now = now
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def render(self, profile, bodies):
+        if self.workers <= 1:
+            return render_bodies(profile, bodies)
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        size = max(1, len(bodies) // (self.workers * 4))
+        chunks = [bodies[i:i + size] for i in range(0, len(bodies), size)]
+        results = self._pool.map(partial(render_bodies, profile), chunks)
+        return [html for chunk in results for html in chunk]
+
+    def past(self, days=365):
+        return self.now - timedelta(
+            seconds=self.random.randrange(days * 24 * 60 * 60),
+        )
+
+    def batches(self, count):
+        for start in range(0, count, self.batch_size):
+            yield min(self.batch_size, count - start)
+
+    @staticmethod
+    def ids(table):
+        return [row[0] for row in db.session.execute(
+            db.select([table.c.id]).order_by(table.c.id),
+        )]
+
+    @staticmethod
+    def insert(table, rows):
+        # 一次 executemany 寫入，再依 id 順序取回新資料列的 id
+        last_id = db.session.scalar(db.select([db.func.max(table.c.id)])) or 0
+        db.session.execute(table.insert(), rows)
+        return [row[0] for row in db.session.execute(
+            db.select([table.c.id])
+            .where(table.c.id > last_id)
+            .order_by(table.c.id),
+        )]
+
+    def increment(self, column, counts):
+        if not counts:
+            return
+        table = column.table
+        # 明確寫入 updated_at，不使用 onupdate 產生的目前時間
+        db.session.execute(
+            table.update()
+            .where(table.c.id == db.bindparam('row_id'))
+            .values({
+                column.name: column + db.bindparam('amount'),
+                'updated_at': self.now,
+            }),
+            [
+                {'row_id': id, 'amount': amount}
+                for id, amount in counts.items()
+            ],
         )
-        db.session.add(user)
-        try:
+
+    def unique(self, generate, taken, mangle):
+        value = generate()
+        while value in taken:
+            value = mangle(generate(), self.random.randrange(10 ** 6))
+        taken.add(value)
+        return value
+
+    def users(self, count=100):
+        users = User.__table__
+        usernames = {row[0] for row in db.session.query(User.username)}
+        emails = {row[0] for row in db.session.query(User.email)}
+        # 雜湊很慢，所有假使用者共用同一個密碼雜湊
+        password_hash = generate_password_hash('password')
+        role_id = Role.query.filter_by(default=True).first().id
+
+        for size in self.batches(count):
+            rows = []
+            for _ in range(size):
+                email = self.unique(
+                    self.faker.email,
+                    emails,
+                    lambda email, n: email.replace('@', f'{n}@', 1),
+                )
+                member_since = self.past()
+                rows.append({
+                    'email': email,
+                    'username': self.unique(
+                        self.faker.user_name,
+                        usernames,
+                        lambda username, n: f'{username}{n}',
+                    ),
+                    'password_hash': password_hash,
+                    'role_id': role_id,
+                    'confirmed': True,
+                    'avatar_hash': hashlib.md5(
+                        email.lower().encode('utf-8'),
+                    ).hexdigest(),
+                    'name': self.faker.name(),
+                    'location': self.faker.city(),
+                    'about_me': self.faker.text(),
+                    'member_since': member_since,
+                    'last_seen': member_since,
+                    'updated_at': member_since,
+                    'fanout_on_read': False,
+                    'post_count': 0,
+                    'follower_count': 1,
+                    'followed_count': 1,
+                })
+            ids = self.insert(users, rows)
+
+            # 每位使用者都追隨自己
+            db.session.execute(Follow.__table__.insert(), [
+                {'follower_id': id, 'followed_id': id, 'timestamp': self.now}
+                for id in ids
+            ])
             db.session.commit()
-            i += 1
-        except IntegrityError:
-            db.session.rollback()
-
-
-def posts(count=100):
-    faker = Faker()
-    user_count = User.query.count()
-    for i in range(count):
-        user = User.query.offset(randint(0, user_count - 1)).first()
-        post = Post(
-            body=faker.text(),
-            timestamp=faker.past_date(),
-            author=user,
+        follow_graph.invalidate()
+        page_cache.invalidate()
+
+    def follows(self, count=100):
+        follows = Follow.__table__
+        user_ids = self.ids(User.__table__)
+        if not user_ids:
+            return
+        existing = set(db.session.query(
+            Follow.follower_id,
+            Follow.followed_id,
+        ))
+        count = min(
+            count,
+            len(user_ids) * len(user_ids) - len(existing),
         )
-        db.session.add(post)
-    db.session.commit()
+
+        for size in self.batches(count):
+            pairs = []
+            while len(pairs) < size:
+                pair = (
+                    self.random.choice(user_ids),
+                    self.random.choice(user_ids),
+                )
+                if pair not in existing:
+                    existing.add(pair)
+                    pairs.append(pair)
+            db.session.execute(follows.insert(), [
+                {
+                    'follower_id': follower_id,
+                    'followed_id': followed_id,
+                    'timestamp': self.past(),
+                }
+                for follower_id, followed_id in pairs
+            ])
+            self.increment(
+                User.__table__.c.follower_count,
+                Counter(followed_id for _, followed_id in pairs),
+            )
+            self.increment(
+                User.__table__.c.followed_count,
+                Counter(follower_id for follower_id, _ in pairs),
+            )
+            self.mark_fanout_on_read()
+
+            # 新的追隨關係補上作者既有的文章
+            fanout_on_read = {
+                row[0] for row in
+                db.session.query(User.id).filter(User.fanout_on_read)
+            }
+            pairs = [
+                {'follower_id': follower_id, 'followed_id': followed_id}
+                for follower_id, followed_id in pairs
+                if followed_id not in fanout_on_read
+            ]
+            if pairs:
+                posts = Post.__table__
+                db.session.execute(Timeline.__table__.insert().from_select(
+                    ['user_id', 'post_id', 'author_id', 'timestamp'],
+                    db.select([
+                        db.bindparam('follower_id', type_=db.Integer),
+                        posts.c.id,
+                        posts.c.author_id,
+                        posts.c.timestamp,
+                    ]).where(posts.c.author_id == db.bindparam('followed_id')),
+                ), pairs)
+            db.session.commit()
+        # 批次寫入不會觸發 mapper 事件，改為重建
+        follow_graph.invalidate()
+
+    def mark_fanout_on_read(self):
+        users = User.__table__
+        limit = current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']
+        db.session.execute(
+            users.update()
+            .where(users.c.follower_count > limit)
+            .values(fanout_on_read=True, updated_at=self.now),
+        )
+
+    def posts(self, count=100):
+        posts = Post.__table__
+        follows = Follow.__table__
+        users = User.__table__
+        user_ids = self.ids(users)
+        if not user_ids:
+            return
+
+        for size in self.batches(count):
+            # 從記憶體中的 id 清單挑選作者，不必每篇文章查詢一次
+            authors = [self.random.choice(user_ids) for _ in range(size)]
+            bodies = [self.faker.text() for _ in range(size)]
+            timestamps = [self.past() for _ in range(size)]
+            ids = self.insert(posts, [
+                {
+                    'body': body,
+                    'body_html': html,
+                    'timestamp': timestamp,
+                    'updated_at': timestamp,
+                    'author_id': author_id,
+                    'comment_count': 0,
+                }
+                for body, html, timestamp, author_id in zip(
+                    bodies,
+                    self.render('post', bodies),
+                    timestamps,
+                    authors,
+                )
+            ])
+            self.increment(users.c.post_count, Counter(authors))
+
+            # 把新文章推送到追隨者的時間軸
+            db.session.execute(Timeline.__table__.insert().from_select(
+                ['user_id', 'post_id', 'author_id', 'timestamp'],
+                db.select([
+                    follows.c.follower_id,
+                    posts.c.id,
+                    posts.c.author_id,
+                    posts.c.timestamp,
+                ])
+                .select_from(
+                    posts
+                    .join(follows, follows.c.followed_id == posts.c.author_id)
+                    .join(users, users.c.id == posts.c.author_id),
+                )
+                .where(posts.c.id.between(ids[0], ids[-1]))
+                .where(db.not_(users.c.fanout_on_read)),
+            ))
+            self.index('posts', zip(ids, bodies))
+            db.session.commit()
+        page_cache.invalidate()
+
+    def comments(self, count=100):
+        comments = Comment.__table__
+        user_ids = self.ids(User.__table__)
+        post_ids = self.ids(Post.__table__)
+        if not user_ids or not post_ids:
+            return
+
+        for size in self.batches(count):
+            authors = [self.random.choice(user_ids) for _ in range(size)]
+            targets = [self.random.choice(post_ids) for _ in range(size)]
+            bodies = [self.faker.sentence() for _ in range(size)]
+            timestamps = [self.past() for _ in range(size)]
+            ids = self.insert(comments, [
+                {
+                    'body': body,
+                    'body_html': html,
+                    'timestamp': timestamp,
+                    'updated_at': timestamp,
+                    'disabled': False,
+                    'author_id': author_id,
+                    'post_id': post_id,
+                }
+                for body, html, timestamp, author_id, post_id in zip(
+                    bodies,
+                    self.render('comment', bodies),
+                    timestamps,
+                    authors,
+                    targets,
+                )
+            ])
+            self.increment(
+                Post.__table__.c.comment_count,
+                Counter(targets),
+            )
+            self.index('comments', zip(ids, bodies))
+            db.session.commit()
+        page_cache.invalidate()
+
+    @staticmethod
+    def index(table, rows):
+        connection = db.session.connection()
+        search_index.backend(connection).index_many(connection, table, rows)
+
+
+def users(count=100, **kwargs):
+    with Generator(**kwargs) as generator:
+        generator.users(count)
+
+
+def follows(count=100, **kwargs):
+    with Generator(**kwargs) as generator:
+        generator.follows(count)
+
+
+def posts(count=100, **kwargs):
+    with Generator(**kwargs) as generator:
+        generator.posts(count)
+
+
+def comments(count=100, **kwargs):
+    with Generator(**kwargs) as generator:
+        generator.comments(count)
+
+
+def generate(users=100, follows=500, posts=1000, comments=2000, **kwargs):
+    # 依序建立，讓時間軸在寫入文章時就能直接推送
+    with Generator(**kwargs) as generator:
+        generator.users(users)
+        generator.follows(follows)
+        generator.posts(posts)
+        generator.comments(comments)
@@ -9,31 +9,19 @@ from flask import (
     make_response,
 )
 from flask_login import current_user, login_required
-from flask_sqlalchemy import get_debug_queries
 
 from . import main
 from .forms import PostForm, CommentForm
 from .. import db
+from ..cache import page_cache
 from ..decorators import permission_required
 from ..models import Permission, Post, Comment
-
-
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['FLASKY_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: {}\nParameters{}\nDuration{}\nContext{}\n'.format(
-                    query.statement,
-                    query.parameters,
-                    query.duration,
-                    query.context,
-                ),
-            )
-    return response
+from ..replica import read_write
+from ..search import search_index
 
 
 @main.route('/', methods=['GET', 'POST'])
+@page_cache.cached
 def index():
     form = PostForm()
     if current_user.can(Permission.WRITE) and \
@@ -50,12 +38,13 @@ def index():
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
     if show_followed:
-        query = current_user.followed_posts
+        query, keys = current_user.timeline()
     else:
-        query = Post.query
+        query, keys = Post.query, (Post.timestamp, Post.id)
 
     page = request.args.get('page', 1, type=int)
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
+    pagination = query.options(db.joinedload(Post.author)) \
+        .order_by(*(key.desc() for key in keys)).paginate(
         page,
         per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
         error_out=False,
@@ -95,6 +84,7 @@ def show_followed():
 
 
 @main.route('/post/<int:id>', methods=['GET', 'POST'])
+@page_cache.cached
 def show(id):
     post = Post.query.get_or_404(id)
     form = CommentForm()
@@ -111,9 +101,10 @@ def show(id):
 
     page = request.args.get('page', 1, type=int)
     if page == -1:
-        page = (post.comments.count() - 1) // \
+        page = (post.comment_count - 1) // \
                current_app.config['FLASKY_COMMENTS_PER_PAGE'] + 1
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
+    pagination = post.comments.options(db.joinedload(Comment.author)) \
+        .order_by(Comment.timestamp.asc()).paginate(
         page,
         per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
         error_out=False,
@@ -128,6 +119,24 @@ def show(id):
     )
 
 
+@main.route('/search')
+def search():
+    q = request.args.get('q', '')
+    pagination = search_index.search(
+        Post,
+        q,
+        page=request.args.get('page', 1, type=int),
+        per_page=current_app.config['FLASKY_SEARCH_RESULTS_PER_PAGE'],
+        query=Post.query.options(db.joinedload(Post.author)),
+    )
+    return render_template(
+        'search.html',
+        q=q,
+        posts=pagination.items,
+        pagination=pagination,
+    )
+
+
 @main.route('/edit/<int:id>', methods=['GET', 'POST'])
 @login_required
 def edit(id):
@@ -152,7 +161,8 @@ def edit(id):
 @permission_required(Permission.MODERATE)
 def moderate():
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
+    pagination = Comment.query.options(db.joinedload(Comment.author)) \
+        .order_by(Comment.timestamp.desc()).paginate(
         page,
         per_page=current_app.config['FLASKY_COMMENTS_PER_PAGE'],
         error_out=False,
@@ -167,6 +177,7 @@ def moderate():
 
 
 @main.route('/moderate/enable/<int:id>')
+@read_write
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_enable(id):
@@ -179,6 +190,7 @@ def moderate_enable(id):
 
 
 @main.route('/moderate/disable/<int:id>')
+@read_write
 @login_required
 @permission_required(Permission.MODERATE)
 def moderate_disable(id):
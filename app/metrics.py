@@ -0,0 +1,279 @@
+import glob
+import hmac
+import json
+import os
+import time
+from collections import defaultdict
+from threading import Lock
+
+from flask import abort, g, request, Response, before_render_template, \
+    template_rendered
+
+from .profiler import query_profiler
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+COUNTERS = {
+    'flasky_http_requests_total': 'Total HTTP requests.',
+    'flasky_db_query_seconds_total': 'Time spent in database queries.',
+    'flasky_db_queries_total': 'Number of database queries.',
+    'flasky_template_render_seconds_total': 'Time spent rendering templates.',
+}
+HISTOGRAM = 'flasky_http_request_duration_seconds'
+GAUGE = 'flasky_http_requests_in_progress'
+# 查詢分析器最近幾個請求的百分位數，每個 worker 各自計算，以 pid 區分
+PROFILER_GAUGES = {
+    'flasky_db_queries_per_request': (
+        'queries',
+        'Database queries per request over the recent window.',
+    ),
+    'flasky_db_seconds_per_request': (
+        'db_time',
+        'Database time per request over the recent window.',
+    ),
+}
+
+
+def format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+            .replace('\n', '\\n')
+
+    return '{' + ','.join(
+        f'{key}="{escape(value)}"' for key, value in labels
+    ) + '}'
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Metrics:
+    def __init__(self, app=None):
+        self.directory = None
+        self.flush_interval = 1.0
+        self.token = None
+        self.allowed_ips = ()
+        self._lock = Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = app.config.get('FLASKY_METRICS_DIR')
+        self.flush_interval = app.config.get(
+            'FLASKY_METRICS_FLUSH_INTERVAL',
+            1.0,
+        )
+        self.token = app.config.get('FLASKY_METRICS_TOKEN')
+        self.allowed_ips = app.config.get(
+            'FLASKY_METRICS_ALLOWED_IPS',
+            ('127.0.0.1', '::1'),
+        )
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.reset()
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        before_render_template.connect(self.before_render, app)
+        template_rendered.connect(self.after_render, app)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    def reset(self):
+        with self._lock:
+            self._counters = defaultdict(float)
+            self._histograms = {}
+            self._in_progress = defaultdict(int)
+            self._flushed_at = 0.0
+
+    def before_request(self):
+        g.metrics_endpoint = request.endpoint or 'unknown'
+        g.metrics_start = time.perf_counter()
+        g.metrics_render_time = 0.0
+        with self._lock:
+            self._in_progress[(('endpoint', g.metrics_endpoint),)] += 1
+
+    def before_render(self, sender, template, context, **extra):
+        g.metrics_render_start = time.perf_counter()
+
+    def after_render(self, sender, template, context, **extra):
+        start = g.pop('metrics_render_start', None)
+        if start is not None:
+            g.metrics_render_time = g.get('metrics_render_time', 0.0) + \
+                time.perf_counter() - start
+
+    def after_request(self, response):
+        if 'metrics_start' not in g:
+            return response
+
+        duration = time.perf_counter() - g.metrics_start
+        endpoint = (('endpoint', g.metrics_endpoint),)
+        queries = query_profiler.queries()
+        with self._lock:
+            self._counters[('flasky_http_requests_total', endpoint + (
+                ('method', request.method),
+                ('status', response.status_code),
+            ))] += 1
+            self._counters[('flasky_db_queries_total', endpoint)] += \
+                len(queries)
+            self._counters[('flasky_db_query_seconds_total', endpoint)] += \
+                sum(duration for _, duration in queries)
+            self._counters[(
+                'flasky_template_render_seconds_total',
+                endpoint,
+            )] += g.metrics_render_time
+
+            histogram = self._histograms.setdefault(
+                endpoint,
+                [0] * (len(LATENCY_BUCKETS) + 1) + [0.0],
+            )
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if duration <= bound:
+                    break
+            else:
+                i = len(LATENCY_BUCKETS)
+            histogram[i] += 1
+            histogram[-1] += duration
+
+        if self.directory and \
+                time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+        return response
+
+    def teardown_request(self, exception):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is not None:
+            with self._lock:
+                self._in_progress[(('endpoint', endpoint),)] -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [
+                    [name, labels, value]
+                    for (name, labels), value in self._counters.items()
+                ],
+                'histograms': [
+                    [labels, values]
+                    for labels, values in self._histograms.items()
+                ],
+                'in_progress': [
+                    [labels, value]
+                    for labels, value in self._in_progress.items()
+                ],
+                'profiler': query_profiler.stats(),
+            }
+
+    def flush(self):
+        # 每個 worker 各寫一個檔案，先寫暫存檔再替換，避免讀到寫一半的內容
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+        self._flushed_at = time.monotonic()
+
+    def collect(self):
+        if not self.directory:
+            return [self.snapshot()]
+
+        self.flush()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def render(self):
+        counters = defaultdict(float)
+        histograms = {}
+        in_progress = defaultdict(int)
+        profiler = {}
+        for snapshot in self.collect():
+            for name, labels, value in snapshot['counters']:
+                counters[(name, tuple(map(tuple, labels)))] += value
+            for labels, values in snapshot['histograms']:
+                merged = histograms.setdefault(
+                    tuple(map(tuple, labels)),
+                    [0] * len(values),
+                )
+                for i, value in enumerate(values):
+                    merged[i] += value
+            # 已經結束的 worker 不會再有進行中的請求
+            if snapshot['pid'] == os.getpid() or is_alive(snapshot['pid']):
+                for labels, value in snapshot['in_progress']:
+                    in_progress[tuple(map(tuple, labels))] += value
+                profiler[snapshot['pid']] = snapshot.get('profiler', {})
+
+        lines = []
+        for name, description in COUNTERS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} counter')
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+
+        lines.append(f'# HELP {HISTOGRAM} HTTP request latency.')
+        lines.append(f'# TYPE {HISTOGRAM} histogram')
+        for labels, values in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values):
+                cumulative += count
+                bucket_labels = format_labels(labels + (('le', bound),))
+                lines.append(f'{HISTOGRAM}_bucket{bucket_labels} {cumulative}')
+            lines.append(
+                f'{HISTOGRAM}_sum{format_labels(labels)} {values[-1]}',
+            )
+            lines.append(
+                f'{HISTOGRAM}_count{format_labels(labels)} {cumulative}',
+            )
+
+        lines.append(f'# HELP {GAUGE} HTTP requests currently in progress.')
+        lines.append(f'# TYPE {GAUGE} gauge')
+        for labels, value in sorted(in_progress.items()):
+            lines.append(f'{GAUGE}{format_labels(labels)} {value}')
+
+        for name, (key, description) in PROFILER_GAUGES.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} gauge')
+            for pid, stats in sorted(profiler.items()):
+                for endpoint, values in sorted(stats.items()):
+                    for field, quantile in (('p50', 0.5), ('p95', 0.95)):
+                        labels = format_labels((
+                            ('endpoint', endpoint),
+                            ('pid', pid),
+                            ('quantile', quantile),
+                        ))
+                        lines.append(f'{name}{labels} {values[key][field]}')
+        return '\n'.join(lines) + '\n'
+
+    def authorized(self):
+        # 設定權杖時以 Bearer 權杖驗證，否則只允許來自指定位址的請求
+        if self.token:
+            header = request.headers.get('Authorization', '')
+            return hmac.compare_digest(
+                header.encode('utf-8'),
+                f'Bearer {self.token}'.encode('utf-8'),
+            )
+        return request.remote_addr in self.allowed_ips
+
+    def view(self):
+        if not self.authorized():
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+metrics = Metrics()
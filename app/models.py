@@ -1,15 +1,30 @@
+import atexit
 import hashlib
+import os
+import sys
+import time
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from collections import OrderedDict
 from datetime import datetime
+from threading import Event, Lock, Thread, local
 
-import bleach
 from flask import current_app, url_for
 from flask_login import UserMixin, AnonymousUserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.sql.expression import UpdateBase
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from . import db, login_manager
 from .exceptions import ValidationError
+from .cache import page_cache
+from .render import render_cache
+from .replica import replica
+from .search import search_index
 
 
 class Permission:
@@ -87,8 +102,40 @@ class Role(db.Model):
         return f'<Role {self.name!r}>'
 
 
+class RoleCache:
+    def __init__(self):
+        self._permissions = None
+        self._loaded_at = 0
+
+    def permissions(self, role_id):
+        permissions = self._permissions
+        expired = time.monotonic() - self._loaded_at > \
+            current_app.config['FLASKY_ROLE_CACHE_TTL']
+        if permissions is None or expired or role_id not in permissions:
+            with replica.primary():
+                permissions = dict(
+                    db.session.query(Role.id, Role.permissions).all(),
+                )
+            self._permissions = permissions
+            self._loaded_at = time.monotonic()
+        return permissions.get(role_id) or 0
+
+    def invalidate(self, *args):
+        self._permissions = None
+
+
+role_cache = RoleCache()
+
+db.event.listen(Role, 'after_insert', role_cache.invalidate)
+db.event.listen(Role, 'after_update', role_cache.invalidate)
+db.event.listen(Role, 'after_delete', role_cache.invalidate)
+
+
 class Follow(db.Model):
     __tablename__ = 'follows'
+    __table_args__ = (
+        db.Index('ix_follows_followed_id', 'followed_id'),
+    )
     follower_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id'),
@@ -101,6 +148,34 @@ class Follow(db.Model):
     )
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        users = User.__table__
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.follower_id)
+            .values(followed_count=users.c.followed_count + 1),
+        )
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.followed_id)
+            .values(follower_count=users.c.follower_count + 1),
+        )
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        users = User.__table__
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.follower_id)
+            .values(followed_count=users.c.followed_count - 1),
+        )
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.followed_id)
+            .values(follower_count=users.c.follower_count - 1),
+        )
+
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -116,6 +191,15 @@ class User(UserMixin, db.Model):
     about_me = db.Column(db.Text())
     member_since = db.Column(db.DateTime(), default=datetime.utcnow)
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime(),
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
+    fanout_on_read = db.Column(db.Boolean, default=False)
+    post_count = db.Column(db.Integer, default=0, nullable=False)
+    follower_count = db.Column(db.Integer, default=0, nullable=False)
+    followed_count = db.Column(db.Integer, default=0, nullable=False)
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     followed = db.relationship(
         'Follow',
@@ -225,15 +309,25 @@ class User(UserMixin, db.Model):
         return True
 
     def can(self, permission):
-        return self.role and self.role.has_permission(permission)
+        if self.role_id is None:
+            # 尚未寫入資料庫的使用者只能看記憶體中的角色
+            return self.role is not None and \
+                self.role.has_permission(permission)
+
+        permissions = role_cache.permissions(self.role_id)
+        return permissions & permission == permission
 
     def is_administrator(self):
         return self.can(Permission.ADMIN)
 
     def ping(self):
-        self.last_seen = datetime.utcnow()
-        db.session.add(self)
-        db.session.commit()
+        now = datetime.utcnow()
+        previous = self.last_seen
+        # 只更新記憶體中的值，資料庫由 last_seen_buffer 批次寫入
+        set_committed_value(self, 'last_seen', now)
+        if previous is None or (now - previous).total_seconds() >= \
+                last_seen_buffer.staleness:
+            last_seen_buffer.record(self.id, now)
 
     def gravatar_hash(self):
         return hashlib.md5(self.email.lower().encode('utf-8')).hexdigest()
@@ -244,31 +338,53 @@ class User(UserMixin, db.Model):
         return f'{url}/{hash}?s={size}&d={default}&r={rating}'
 
     def follow(self, user):
-        if not self.is_following(user):
-            follow = Follow(follower=self, followed=user)
-            db.session.add(follow)
+        # 寫入前以資料庫為準，其他 worker 的追隨關係可能還沒同步到記憶體
+        if user.id is not None and \
+                self.followed.filter_by(followed_id=user.id).first():
+            return False
+        db.session.add(Follow(follower=self, followed=user))
+        return True
 
     def unfollow(self, user):
         follow = self.followed.filter_by(followed_id=user.id).first()
-        if follow:
-            db.session.delete(follow)
+        if not follow:
+            return False
+        db.session.delete(follow)
+        return True
 
     def is_following(self, user):
-        if not user.id:
+        if not self.id or not user.id:
             return False
-        return self.followed.filter_by(followed_id=user.id) \
-                   .first() is not None
+        return follow_graph.is_following(self.id, user.id)
 
     def is_followed_by(self, user):
-        if not user.id:
+        if not self.id or not user.id:
             return False
-        return self.followers.filter_by(follower_id=user.id) \
-                   .first() is not None
+        return follow_graph.is_following(user.id, self.id)
 
     @property
     def followed_posts(self):
-        return Post.query.join(Follow, Follow.followed_id == Post.author_id) \
-            .filter(Follow.followed_id == self.id)
+        return self.timeline()[0]
+
+    def timeline(self):
+        # 回傳查詢與排序用的 (時間, id) 欄位
+        # 追隨了 fan-out-on-read 的使用者時，才需要合併讀取他們的文章
+        celebrities = db.session.query(Follow.followed_id) \
+            .join(User, User.id == Follow.followed_id) \
+            .filter(Follow.follower_id == self.id, User.fanout_on_read)
+        if not db.session.query(celebrities.exists()).scalar():
+            # 依 timelines 的欄位排序，分頁只需掃描一段索引
+            query = Post.query.join(Timeline, Timeline.post_id == Post.id) \
+                .filter(Timeline.user_id == self.id)
+            return query, (Timeline.timestamp, Timeline.post_id)
+
+        timeline = db.session.query(Timeline.post_id) \
+            .filter(Timeline.user_id == self.id)
+        query = Post.query.filter(db.or_(
+            Post.id.in_(timeline),
+            Post.author_id.in_(celebrities),
+        ))
+        return query, (Post.timestamp, Post.id)
 
     @staticmethod
     def add_self_follows():
@@ -286,13 +402,20 @@ class User(UserMixin, db.Model):
         return serializer.dumps({'id': self.id}).decode('utf-8')
 
     @staticmethod
-    def verify_auth_token(token):
+    def load_auth_token(token):
         serializer = Serializer(current_app.config['SECRET_KEY'])
         try:
-            data = serializer.loads(token)
+            data, header = serializer.loads(token, return_header=True)
         except Exception:
+            return None, None
+        return data['id'], header['exp']
+
+    @staticmethod
+    def verify_auth_token(token):
+        user_id, expiration = User.load_auth_token(token)
+        if user_id is None:
             return None
-        return User.query.get(data['id'])
+        return User.query.get(user_id)
 
     def to_json(self):
         return {
@@ -305,7 +428,7 @@ class User(UserMixin, db.Model):
                 'api.get_user_followed_posts',
                 id=self.id,
             ),
-            'post_count': self.posts.count(),
+            'post_count': self.post_count,
         }
 
     def __repr__(self):
@@ -323,32 +446,449 @@ class AnonymousUser(AnonymousUserMixin):
 login_manager.anonymous_user = AnonymousUser
 
 
+class UserCache:
+    # 快照只保存這些欄位，計數等其他欄位在使用時才載入
+    columns = (
+        'id', 'email', 'username', 'password_hash', 'role_id', 'confirmed',
+        'avatar_hash', 'name', 'location', 'about_me', 'member_since',
+        'last_seen',
+    )
+
+    def __init__(self, app=None):
+        self.ttl = 30
+        self.maxsize = 10000
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config.get('FLASKY_USER_CACHE_TTL', 30)
+        self.maxsize = app.config.get('FLASKY_USER_CACHE_SIZE', 10000)
+        self.clear()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                snapshot = entry[1]
+            else:
+                self.misses += 1
+                snapshot = None
+
+        if snapshot is not None:
+            user = User.__mapper__.class_manager.new_instance()
+            for key, value in snapshot.items():
+                setattr(user, key, value)
+            db.make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+        with replica.primary():
+            user = User.query.get(user_id)
+        if user is not None and self.ttl > 0:
+            snapshot = {key: getattr(user, key) for key in self.columns}
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, snapshot)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def on_update(self, mapper, connection, target):
+        state = db.inspect(target)
+        for key in self.columns:
+            if key != 'last_seen' and state.attrs[key].history.has_changes():
+                self.on_delete(mapper, connection, target)
+                return
+
+    def on_delete(self, mapper, connection, target):
+        # flush 時只記下 id，交易提交後才移除快照，
+        # 避免其他請求在提交前又從舊的資料列填回快取
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('user_cache_changed', set()) \
+                .add(target.id)
+
+    def on_commit(self, session):
+        for user_id in session.info.pop('user_cache_changed', ()):
+            self.invalidate(user_id)
+
+    def on_rollback(self, session):
+        session.info.pop('user_cache_changed', None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+user_cache = UserCache()
+
+db.event.listen(User, 'after_update', user_cache.on_update)
+db.event.listen(User, 'after_delete', user_cache.on_delete)
+db.event.listen(db.session, 'after_commit', user_cache.on_commit)
+db.event.listen(db.session, 'after_rollback', user_cache.on_rollback)
+
+
+class FollowGraph:
+    # 每位使用者的追隨與粉絲各存成排序好的整數陣列
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.ttl = 60
+        self._followed = None
+        self._followers = None
+        self._generation = uuid.uuid4().hex
+        self._loaded_generation = None
+        self._lock = Lock()
+        self._thread = None
+        self._stopped = Event()
+        self._wake = Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._stop()
+        self.app = app
+        self.directory = app.config.get('FLASKY_FOLLOW_GRAPH_DIR')
+        self.ttl = app.config.get('FLASKY_FOLLOW_GRAPH_TTL', 60)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._followed = None
+            self._followers = None
+            self._loaded_generation = None
+        # 每個 worker 啟動後在背景建立圖，請求不必等待載入
+        app.before_first_request(self.start)
+
+    def _path(self):
+        return os.path.join(self.directory, 'generation')
+
+    def generation(self):
+        if not self.directory:
+            return self._generation
+        try:
+            with open(self._path()) as f:
+                return f.read()
+        except OSError:
+            return ''
+
+    def _bump(self):
+        # 世代存在共用的目錄中，其他 worker 讀取前比對就知道圖已過期
+        generation = uuid.uuid4().hex
+        if self.directory:
+            tmp = f'{self._path()}.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                f.write(generation)
+            os.replace(tmp, self._path())
+        else:
+            self._generation = generation
+        return generation
+
+    def invalidate(self, *args):
+        self._bump()
+        self._wake.set()
+
+    @staticmethod
+    def load():
+        # 依 follower_id 排序讀取，兩個方向的陣列都會是排序好的
+        followed = {}
+        followers = {}
+        rows = db.session.query(Follow.follower_id, Follow.followed_id) \
+            .order_by(Follow.follower_id, Follow.followed_id) \
+            .yield_per(10000)
+        for follower_id, followed_id in rows:
+            followed.setdefault(follower_id, array('i')).append(followed_id)
+            followers.setdefault(followed_id, array('i')).append(follower_id)
+        return followed, followers
+
+    def refresh(self):
+        # 先記下世代再載入，載入期間的異動會讓新的圖立即過期
+        generation = self.generation()
+        with replica.primary():
+            followed, followers = self.load()
+        with self._lock:
+            self._followed, self._followers = followed, followers
+            self._loaded_generation = generation
+
+    def start(self):
+        if self.ttl <= 0 or self._thread is not None:
+            return
+        self._stopped = Event()
+        self._thread = Thread(
+            target=self._work,
+            args=(self.app, self._stopped),
+            name='follow-graph-loader',
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _work(self, app, stopped):
+        # 啟動時建立，之後在過期時或每隔 ttl 秒重建
+        while not stopped.is_set():
+            self._wake.clear()
+            with app.app_context():
+                try:
+                    self.refresh()
+                except Exception:
+                    app.logger.exception('Failed to load the follow graph')
+            self._wake.wait(self.ttl)
+
+    def _stop(self):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            self._wake.set()
+            thread.join()
+
+    def _current(self):
+        generation = self.generation()
+        with self._lock:
+            if self._followed is not None and \
+                    self._loaded_generation == generation:
+                return self._followed
+        self._wake.set()
+        return None
+
+    @staticmethod
+    def _contains(values, value):
+        i = bisect_left(values, value)
+        return i < len(values) and values[i] == value
+
+    def is_following(self, follower_id, followed_id):
+        followed = self._current()
+        if followed is not None:
+            return self._contains(followed.get(follower_id, ()), followed_id)
+        # 圖還沒建好或已過期時改查資料庫，背景會重建
+        with db.session.no_autoflush:
+            return db.session.query(
+                Follow.query.filter_by(
+                    follower_id=follower_id,
+                    followed_id=followed_id,
+                ).exists(),
+            ).scalar()
+
+    def on_insert(self, mapper, connection, target):
+        # flush 時只記下異動，交易提交後才套用到圖上
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('follow_graph_changes', []).append(
+                (True, target.follower_id, target.followed_id),
+            )
+
+    def on_delete(self, mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('follow_graph_changes', []).append(
+                (False, target.follower_id, target.followed_id),
+            )
+
+    def on_commit(self, session):
+        changes = session.info.pop('follow_graph_changes', None)
+        if not changes:
+            return
+        previous = self.generation()
+        generation = self._bump()
+        with self._lock:
+            if self._followed is None:
+                return
+            for added, follower_id, followed_id in changes:
+                self._apply(added, follower_id, followed_id)
+            # 圖原本就是最新的，套用這次的異動後仍是最新的
+            if self._loaded_generation == previous:
+                self._loaded_generation = generation
+                return
+        self._wake.set()
+
+    def on_rollback(self, session):
+        session.info.pop('follow_graph_changes', None)
+
+    def _apply(self, added, follower_id, followed_id):
+        for graph, key, value in (
+            (self._followed, follower_id, followed_id),
+            (self._followers, followed_id, follower_id),
+        ):
+            if added:
+                values = graph.setdefault(key, array('i'))
+                if not self._contains(values, value):
+                    insort(values, value)
+            else:
+                values = graph.get(key, ())
+                if self._contains(values, value):
+                    values.remove(value)
+                    if not values:
+                        del graph[key]
+
+    def stats(self):
+        with self._lock:
+            if self._followed is None:
+                return {'loaded': False, 'users': 0, 'edges': 0, 'bytes': 0}
+            graphs = (self._followed, self._followers)
+            return {
+                'loaded': True,
+                'users': len(self._followed.keys() | self._followers.keys()),
+                'edges': sum(map(len, self._followed.values())),
+                'bytes': sum(
+                    sys.getsizeof(graph) + sum(
+                        sys.getsizeof(key) + sys.getsizeof(values)
+                        for key, values in graph.items()
+                    )
+                    for graph in graphs
+                ),
+            }
+
+
+follow_graph = FollowGraph()
+
+db.event.listen(Follow, 'after_insert', follow_graph.on_insert)
+db.event.listen(Follow, 'after_delete', follow_graph.on_delete)
+db.event.listen(db.session, 'after_commit', follow_graph.on_commit)
+db.event.listen(db.session, 'after_rollback', follow_graph.on_rollback)
+
+
+class LastSeenBuffer:
+    def __init__(self, app=None):
+        self.app = None
+        self.flush_interval = 10
+        self.staleness = 60
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+        self._lock = Lock()
+        self._thread = None
+        self._stopped = Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.app is None:
+            atexit.register(self.shutdown)
+        else:
+            self._stop()
+        self.app = app
+        self.flush_interval = app.config.get(
+            'FLASKY_LAST_SEEN_FLUSH_INTERVAL',
+            10,
+        )
+        self.staleness = app.config.get('FLASKY_LAST_SEEN_STALENESS', 60)
+        with self._lock:
+            self._pending.clear()
+            self._flushed_at = time.monotonic()
+
+    def record(self, user_id, timestamp):
+        with self._lock:
+            self._pending[user_id] = timestamp
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+            if self._thread is None and self.app is not None:
+                self._stopped = Event()
+                self._thread = Thread(
+                    target=self._work,
+                    args=(self.app, self._stopped),
+                    name='last-seen-flusher',
+                    daemon=True,
+                )
+                self._thread.start()
+        if due:
+            self.flush()
+
+    def _work(self, app, stopped):
+        # 沒有新的請求時也定期寫入，緩衝的時間才有上限
+        while not stopped.wait(self.flush_interval):
+            with self._lock:
+                due = self._pending and \
+                    time.monotonic() - self._flushed_at >= self.flush_interval
+            if not due:
+                continue
+            with app.app_context():
+                try:
+                    self.flush()
+                except Exception:
+                    app.logger.exception('Failed to flush last_seen')
+
+    def _stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        if not pending:
+            return 0
+
+        users = User.__table__
+        statement = users.update() \
+            .where(users.c.id == db.bindparam('user_id')) \
+            .values(last_seen=db.bindparam('timestamp'))
+        with db.engine.begin() as connection:
+            connection.execute(statement, [
+                {'user_id': user_id, 'timestamp': timestamp}
+                for user_id, timestamp in pending.items()
+            ])
+        TableVersion.publish()
+        return len(pending)
+
+    def shutdown(self):
+        self._stop()
+        if self._pending and self.app is not None:
+            with self.app.app_context():
+                self.flush()
+
+
+last_seen_buffer = LastSeenBuffer()
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
 
 class Post(db.Model):
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_author_id_timestamp', 'author_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime,
+        index=True,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    comment_count = db.Column(db.Integer, default=0, nullable=False)
     comments = db.relationship('Comment', backref='post', lazy='dynamic')
 
     @staticmethod
     def on_change_body(target, value, old_value, initiator):
-        allowed_tags = [
-            'a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
-            'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
-            'h1', 'h2', 'h3', 'p',
-        ]
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags,
-            strip=True,
-        ))
+        if value == old_value and target.body_html:
+            return
+        target.body_html = render_cache.render(value, 'post')
 
     def to_json(self):
         return {
@@ -358,9 +898,27 @@ class Post(db.Model):
             'timestamp': self.timestamp,
             'author_url': url_for('api.get_user', id=self.author_id),
             'comments_url': url_for('api.get_post_comments', id=self.id),
-            'comment_count': self.comments.count(),
+            'comment_count': self.comment_count,
         }
 
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        users = User.__table__
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.author_id)
+            .values(post_count=users.c.post_count + 1),
+        )
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        users = User.__table__
+        connection.execute(
+            users.update()
+            .where(users.c.id == target.author_id)
+            .values(post_count=users.c.post_count - 1),
+        )
+
     @staticmethod
     def from_json(json_post):
         body = json_post.get('body')
@@ -370,28 +928,37 @@ class Post(db.Model):
 
 
 db.event.listen(Post.body, 'set', Post.on_change_body)
+db.event.listen(Post, 'after_insert', Post.on_insert)
+db.event.listen(Post, 'after_delete', Post.on_delete)
+db.event.listen(Post, 'after_insert', page_cache.on_change)
+db.event.listen(Post, 'after_update', page_cache.on_change)
+db.event.listen(Post, 'after_delete', page_cache.on_change)
 
 
 class Comment(db.Model):
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index('ix_comments_post_id_timestamp', 'post_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    updated_at = db.Column(
+        db.DateTime,
+        index=True,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+    )
     disabled = db.Column(db.Boolean)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
 
     @staticmethod
     def on_change_body(target, value, old_value, initiator):
-        allowed_tags = [
-            'a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong',
-        ]  # 移除段落標籤，僅含字元標籤
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags,
-            strip=True,
-        ))
+        if value == old_value and target.body_html:
+            return
+        target.body_html = render_cache.render(value, 'comment')
 
     def to_json(self):
         return {
@@ -410,5 +977,256 @@ class Comment(db.Model):
             raise ValidationError('comment does not have a body')
         return Comment(body=body)
 
+    @staticmethod
+    def on_insert(mapper, connection, target):
+        posts = Post.__table__
+        connection.execute(
+            posts.update()
+            .where(posts.c.id == target.post_id)
+            .values(comment_count=posts.c.comment_count + 1),
+        )
+
+    @staticmethod
+    def on_delete(mapper, connection, target):
+        posts = Post.__table__
+        connection.execute(
+            posts.update()
+            .where(posts.c.id == target.post_id)
+            .values(comment_count=posts.c.comment_count - 1),
+        )
+
 
 db.event.listen(Comment.body, 'set', Comment.on_change_body)
+db.event.listen(Comment, 'after_insert', Comment.on_insert)
+db.event.listen(Comment, 'after_delete', Comment.on_delete)
+db.event.listen(Comment, 'after_insert', page_cache.on_change)
+db.event.listen(Comment, 'after_update', page_cache.on_change)
+db.event.listen(Comment, 'after_delete', page_cache.on_change)
+db.event.listen(db.session, 'after_commit', page_cache.on_commit)
+db.event.listen(db.session, 'after_rollback', page_cache.on_rollback)
+search_index.register(Post)
+search_index.register(Comment)
+db.event.listen(Follow, 'after_insert', Follow.on_insert)
+db.event.listen(Follow, 'after_delete', Follow.on_delete)
+
+
+def counter_columns():
+    users = User.__table__
+    posts = Post.__table__
+    comments = Comment.__table__
+    follows = Follow.__table__
+    return [
+        (users.c.post_count, posts.c.author_id),
+        (users.c.follower_count, follows.c.followed_id),
+        (users.c.followed_count, follows.c.follower_id),
+        (posts.c.comment_count, comments.c.post_id),
+    ]
+
+
+def actual_count(column, foreign_key):
+    return db.select([db.func.count()]) \
+        .where(foreign_key == column.table.c.id) \
+        .as_scalar()
+
+
+def verify_counters():
+    mismatches = {}
+    for column, foreign_key in counter_columns():
+        actual = actual_count(column, foreign_key)
+        mismatches[str(column)] = db.session.scalar(
+            db.select([db.func.count()])
+            .select_from(column.table)
+            .where(column != actual),
+        )
+    return mismatches
+
+
+def rebuild_counters():
+    for column, foreign_key in counter_columns():
+        db.session.execute(column.table.update().values({
+            column.name: actual_count(column, foreign_key),
+        }))
+    db.session.commit()
+
+
+class Timeline(db.Model):
+    __tablename__ = 'timelines'
+    __table_args__ = (
+        # 包含 post_id，分頁的排序與游標條件都能在索引內完成
+        db.Index(
+            'ix_timelines_user_id_timestamp_post_id',
+            'user_id',
+            'timestamp',
+            'post_id',
+        ),
+    )
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id'),
+        primary_key=True,
+    )
+    post_id = db.Column(
+        db.Integer,
+        db.ForeignKey('posts.id'),
+        primary_key=True,
+    )
+    author_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
+    timestamp = db.Column(db.DateTime)
+
+    @staticmethod
+    def is_fanout_on_read(connection, user_id):
+        users = User.__table__
+        return bool(connection.scalar(
+            db.select([users.c.fanout_on_read]).where(users.c.id == user_id),
+        ))
+
+    @staticmethod
+    def on_insert_post(mapper, connection, target):
+        author_id = target.author_id
+        if Timeline.is_fanout_on_read(connection, author_id):
+            return
+
+        follows = Follow.__table__
+        follower_count = connection.scalar(
+            db.select([db.func.count()])
+            .select_from(follows)
+            .where(follows.c.followed_id == author_id),
+        )
+        if follower_count > current_app.config['FLASKY_TIMELINE_FANOUT_LIMIT']:
+            # 追隨者太多，改為讀取時再合併這位作者的文章
+            users = User.__table__
+            connection.execute(
+                users.update()
+                .where(users.c.id == author_id)
+                .values(fanout_on_read=True),
+            )
+            return
+
+        connection.execute(Timeline.__table__.insert().from_select(
+            ['user_id', 'post_id', 'author_id', 'timestamp'],
+            db.select([
+                follows.c.follower_id,
+                db.literal(target.id),
+                db.literal(author_id),
+                db.literal(target.timestamp, db.DateTime),
+            ]).where(follows.c.followed_id == author_id),
+        ))
+
+    @staticmethod
+    def on_delete_post(mapper, connection, target):
+        timelines = Timeline.__table__
+        connection.execute(
+            timelines.delete().where(timelines.c.post_id == target.id),
+        )
+
+    @staticmethod
+    def on_insert_follow(mapper, connection, target):
+        if Timeline.is_fanout_on_read(connection, target.followed_id):
+            return
+
+        posts = Post.__table__
+        connection.execute(Timeline.__table__.insert().from_select(
+            ['user_id', 'post_id', 'author_id', 'timestamp'],
+            db.select([
+                db.literal(target.follower_id),
+                posts.c.id,
+                posts.c.author_id,
+                posts.c.timestamp,
+            ]).where(posts.c.author_id == target.followed_id),
+        ))
+
+    @staticmethod
+    def on_delete_follow(mapper, connection, target):
+        timelines = Timeline.__table__
+        connection.execute(timelines.delete().where(db.and_(
+            timelines.c.user_id == target.follower_id,
+            timelines.c.author_id == target.followed_id,
+        )))
+
+
+db.event.listen(Post, 'after_insert', Timeline.on_insert_post)
+db.event.listen(Post, 'after_delete', Timeline.on_delete_post)
+db.event.listen(Follow, 'after_insert', Timeline.on_insert_follow)
+db.event.listen(Follow, 'after_delete', Timeline.on_delete_follow)
+
+
+# 每個執行緒已提交、尚未遞增版本的資料表
+_committed_tables = local()
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+    # API 清單的 ETag 由這些資料表的版本組成
+    tables = ('users', 'posts', 'comments', 'follows', 'timelines')
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @classmethod
+    def on_create(cls, target, connection, **kw):
+        now = datetime.utcnow()
+        connection.execute(target.insert(), [
+            {'name': name, 'version': 0, 'updated_at': now}
+            for name in cls.tables
+        ])
+
+    @classmethod
+    def on_execute(cls, connection, clause, multiparams, params, result):
+        # ORM flush、計數器與批次寫入都會經過這裡，先記下異動的資料表
+        if not isinstance(clause, UpdateBase):
+            return
+        name = clause.table.name
+        if name in cls.tables:
+            connection.info.setdefault('changed_tables', set()).add(name)
+
+    @staticmethod
+    def on_commit(connection):
+        # 提交之後才在另一個短交易中遞增，寫入的交易不會鎖住版本列
+        changed = connection.info.pop('changed_tables', None)
+        if changed:
+            _committed_tables.names = \
+                getattr(_committed_tables, 'names', set()) | changed
+
+    @staticmethod
+    def on_rollback(connection):
+        connection.info.pop('changed_tables', None)
+
+    @classmethod
+    def publish(cls, *args):
+        names = getattr(_committed_tables, 'names', None)
+        _committed_tables.names = set()
+        if not names:
+            return
+        table = cls.__table__
+        now = datetime.utcnow()
+        # 固定依 tables 的順序更新，並行的提交不會互相死結
+        with db.engine.begin() as connection:
+            for name in cls.tables:
+                if name in names:
+                    connection.execute(
+                        table.update()
+                        .where(table.c.name == name)
+                        .values(version=table.c.version + 1, updated_at=now),
+                    )
+
+    @classmethod
+    def current(cls, *names):
+        rows = {
+            row.name: row for row in db.session.query(
+                cls.name,
+                cls.version,
+                cls.updated_at,
+            ).filter(cls.name.in_(names))
+        }
+        versions = [
+            rows[name].version if name in rows else 0 for name in names
+        ]
+        timestamps = [rows[name].updated_at for name in names if name in rows]
+        return versions, max(timestamps, default=None)
+
+
+db.event.listen(TableVersion.__table__, 'after_create', TableVersion.on_create)
+db.event.listen(Engine, 'after_execute', TableVersion.on_execute)
+db.event.listen(Engine, 'commit', TableVersion.on_commit)
+db.event.listen(Engine, 'rollback', TableVersion.on_rollback)
+db.event.listen(db.session, 'after_commit', TableVersion.publish)
@@ -0,0 +1,171 @@
+import re
+import time
+from collections import Counter, defaultdict, deque
+from threading import Lock
+
+from flask import g, has_request_context, request, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, float('inf'))
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, float('inf'))
+
+
+def statement_shape(statement):
+    # 把參數與 IN 清單收斂成同一個樣板
+    shape = re.sub(r'%\(\w+\)s|:\w+|\$\d+', '?', statement)
+    shape = re.sub(r'\?(\s*,\s*\?)+', '?', shape)
+    return re.sub(r'\s+', ' ', shape).strip()
+
+
+def histogram(values, buckets):
+    counts = [0] * len(buckets)
+    for value in values:
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+    return dict(zip((str(bound) for bound in buckets), counts))
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class QueryProfiler:
+    def __init__(self, app=None):
+        self.window = 1000
+        self.repeat_threshold = 10
+        self.slow_query_time = 0.5
+        self._samples = defaultdict(self._new_samples)
+        self._shapes = defaultdict(Counter)
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def _new_samples(self):
+        return deque(maxlen=self.window)
+
+    def init_app(self, app):
+        self.window = app.config.get('FLASKY_PROFILER_WINDOW', 1000)
+        self.repeat_threshold = app.config.get(
+            'FLASKY_N_PLUS_ONE_THRESHOLD',
+            10,
+        )
+        self.slow_query_time = app.config.get('FLASKY_SLOW_DB_QUERY_TIME', 0.5)
+        self.clear()
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    @staticmethod
+    def before_request():
+        # 只記錄語句與耗時，不使用 Flask-SQLAlchemy 的除錯紀錄
+        g.profiler_queries = []
+
+    @staticmethod
+    def before_cursor_execute(conn, cursor, statement, parameters, context,
+                              executemany):
+        conn.info['profiler_start'] = time.perf_counter()
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        if not has_request_context() or 'profiler_queries' not in g:
+            return
+        duration = time.perf_counter() - conn.info['profiler_start']
+        g.profiler_queries.append((statement, duration))
+        if duration >= self.slow_query_time:
+            current_app.logger.warning(
+                'Slow query: {}\nParameters{}\nDuration{}\n'.format(
+                    statement,
+                    parameters,
+                    duration,
+                ),
+            )
+
+    @staticmethod
+    def queries():
+        # 這次請求執行過的 (語句, 秒數)
+        return g.get('profiler_queries', [])
+
+    def after_request(self, response):
+        queries = self.queries()
+        endpoint = request.endpoint or 'unknown'
+        shapes = Counter()
+        total_time = 0.0
+        for statement, duration in queries:
+            shapes[statement_shape(statement)] += 1
+            total_time += duration
+
+        for shape, count in shapes.items():
+            if count > self.repeat_threshold:
+                current_app.logger.warning(
+                    f'Possible N+1 query in {endpoint}: '
+                    f'{count} executions of {shape}',
+                )
+
+        with self._lock:
+            self._samples[endpoint].append((len(queries), total_time))
+            self._shapes[endpoint].update(
+                shape for shape, count in shapes.items() if count > 1
+            )
+        return response
+
+    @staticmethod
+    def teardown_request(exception):
+        g.pop('profiler_queries', None)
+
+    def stats(self):
+        with self._lock:
+            samples = {
+                endpoint: list(values)
+                for endpoint, values in self._samples.items()
+            }
+            shapes = {
+                endpoint: counter.most_common(5)
+                for endpoint, counter in self._shapes.items()
+            }
+
+        stats = {}
+        for endpoint, values in samples.items():
+            counts = [count for count, _ in values]
+            times = [duration for _, duration in values]
+            stats[endpoint] = {
+                'requests': len(values),
+                'queries': {
+                    'p50': percentile(counts, 0.5),
+                    'p95': percentile(counts, 0.95),
+                    'max': max(counts),
+                    'histogram': histogram(counts, QUERY_COUNT_BUCKETS),
+                },
+                'db_time': {
+                    'total': sum(times),
+                    'p50': percentile(times, 0.5),
+                    'p95': percentile(times, 0.95),
+                    'histogram': histogram(times, DB_TIME_BUCKETS),
+                },
+                'repeated_statements': shapes.get(endpoint, []),
+            }
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._shapes.clear()
+
+
+query_profiler = QueryProfiler()
+
+event.listen(
+    Engine,
+    'before_cursor_execute',
+    query_profiler.before_cursor_execute,
+)
+event.listen(
+    Engine,
+    'after_cursor_execute',
+    query_profiler.after_cursor_execute,
+)
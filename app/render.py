@@ -0,0 +1,111 @@
+import hashlib
+from collections import OrderedDict
+from threading import Lock, local
+
+from bleach.linkifier import LinkifyFilter
+from bleach.sanitizer import Cleaner
+from markdown import Markdown
+
+PROFILES = {
+    'post': [
+        'a', 'abbr', 'acronym', 'b', 'blockquote', 'code',
+        'em', 'i', 'li', 'ol', 'pre', 'strong', 'ul',
+        'h1', 'h2', 'h3', 'p',
+    ],
+    'comment': [
+        'a', 'abbr', 'acronym', 'b', 'code', 'em', 'i', 'strong',
+    ],  # 移除段落標籤，僅含字元標籤
+}
+
+
+class Renderer:
+    def __init__(self, allowed_tags):
+        self.allowed_tags = allowed_tags
+        # Markdown 與 Cleaner 都不是執行緒安全的，每個執行緒各建一份
+        self._local = local()
+
+    def pipeline(self):
+        pipeline = getattr(self._local, 'pipeline', None)
+        if pipeline is None:
+            pipeline = (
+                Markdown(output_format='html'),
+                Cleaner(
+                    tags=self.allowed_tags,
+                    strip=True,
+                    filters=[LinkifyFilter],
+                ),
+            )
+            self._local.pipeline = pipeline
+        return pipeline
+
+    def render(self, body):
+        md, cleaner = self.pipeline()
+        return cleaner.clean(md.reset().convert(body))
+
+
+renderers = {
+    name: Renderer(allowed_tags)
+    for name, allowed_tags in PROFILES.items()
+}
+
+
+class RenderCache:
+    def __init__(self, app=None, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('FLASKY_RENDER_CACHE_SIZE', 1024)
+        self.clear()
+
+    @staticmethod
+    def key(body, allowed_tags):
+        profile = ','.join(sorted(allowed_tags))
+        return hashlib.sha256(
+            f'{profile}\0{body}'.encode('utf-8'),
+        ).hexdigest()
+
+    def render(self, body, profile):
+        renderer = renderers[profile]
+        key = self.key(body, renderer.allowed_tags)
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return html
+            self.misses += 1
+
+        html = renderer.render(body)
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = html
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+render_cache = RenderCache()
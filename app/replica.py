@@ -0,0 +1,183 @@
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import UpdateBase
+
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+def read_only(f):
+    # 不寫入資料的非 GET 路由也可以交給唯讀副本
+    f.read_only = True
+    return f
+
+
+def read_write(f):
+    # 會寫入資料的 GET 路由，整個請求都使用主資料庫
+    f.read_only = False
+    return f
+
+
+class ReplicaRouter:
+    bind_key = 'replica'
+
+    def __init__(self, app=None):
+        self.directory = None
+        self._written = {}
+        self._lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        uri = app.config.get('FLASKY_REPLICA_DATABASE_URI')
+        if uri:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.setdefault(self.bind_key, uri)
+            app.config['SQLALCHEMY_BINDS'] = binds
+        self.directory = app.config.get('FLASKY_REPLICA_STICKY_DIR')
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        self.clear()
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def enabled(self):
+        binds = current_app.config.get('SQLALCHEMY_BINDS') or {}
+        return self.bind_key in binds
+
+    @staticmethod
+    def read_only():
+        view = current_app.view_functions.get(request.endpoint)
+        flag = getattr(view, 'read_only', None)
+        if flag is not None:
+            return flag
+        return request.method in READ_METHODS
+
+    @staticmethod
+    def user_id():
+        # API 以 g.current_user 驗證，網頁則從 Flask-Login 的 session 取得
+        user_id = getattr(g.get('current_user'), 'id', None)
+        if user_id is None:
+            user_id = session.get('_user_id')
+        return None if user_id is None else str(user_id)
+
+    def _path(self, user_id):
+        return os.path.join(self.directory, f'written-{user_id}')
+
+    def written(self, user_id):
+        # 記錄使用者最後一次寫入的時間，設定目錄時所有 worker 共用
+        if self.directory:
+            path = self._path(user_id)
+            with open(path, 'a'):
+                pass
+            os.utime(path)
+            return
+        now = time.time()
+        seconds = current_app.config['FLASKY_REPLICA_STICKY_SECONDS']
+        with self._lock:
+            self._written[user_id] = now
+            if len(self._written) > 10000:
+                self._written = {
+                    key: value for key, value in self._written.items()
+                    if value > now - seconds
+                }
+
+    def sticky(self, user_id):
+        # 同一位使用者寫入後的一段時間內，讀取仍留在主資料庫
+        seconds = current_app.config['FLASKY_REPLICA_STICKY_SECONDS']
+        if self.directory:
+            try:
+                written_at = os.path.getmtime(self._path(user_id))
+            except OSError:
+                return False
+        else:
+            with self._lock:
+                written_at = self._written.get(user_id, 0)
+        return written_at > time.time() - seconds
+
+    def clear(self):
+        with self._lock:
+            self._written.clear()
+
+    def before_request(self):
+        # 沒有登入的寫入以 cookie 記錄，只影響同一個瀏覽器
+        g.use_replica = self.enabled() and self.read_only() \
+            and session.get('primary_until', 0) <= time.time()
+
+    def after_request(self, response):
+        if g.pop('database_written', False) and self.enabled():
+            user_id = self.user_id()
+            if user_id is not None:
+                self.written(user_id)
+            else:
+                session['primary_until'] = time.time() + \
+                    current_app.config['FLASKY_REPLICA_STICKY_SECONDS']
+        return response
+
+    @staticmethod
+    def teardown_request(exception):
+        g.pop('use_replica', None)
+        g.pop('database_written', None)
+        g.pop('sticky_user_id', None)
+
+    @staticmethod
+    def mark_written():
+        # 寫入後這個請求剩下的讀取也改用主資料庫
+        if has_request_context():
+            g.use_replica = False
+            g.database_written = True
+
+    @staticmethod
+    @contextmanager
+    def primary():
+        # 會被快取留下的讀取改走主資料庫，
+        # 否則落後的副本資料會在快取中保留到過期為止
+        if not has_request_context():
+            yield
+            return
+        use_replica = g.get('use_replica', False)
+        g.use_replica = False
+        try:
+            yield
+        finally:
+            g.use_replica = use_replica and \
+                not g.get('database_written', False)
+
+    def use_replica(self):
+        if not has_request_context() or not g.get('use_replica', False):
+            return False
+        # API 的使用者要等驗證後才知道，因此在每次查詢前檢查
+        user_id = self.user_id()
+        if user_id is not None and g.get('sticky_user_id') != user_id:
+            g.sticky_user_id = user_id
+            if self.sticky(user_id):
+                g.use_replica = False
+                return False
+        return True
+
+    def engine(self, app):
+        return get_state(app).db.get_engine(app, bind=self.bind_key)
+
+
+replica = ReplicaRouter()
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        # flush 與 INSERT、UPDATE、DELETE 一律送到主資料庫
+        if self._flushing or isinstance(clause, UpdateBase):
+            replica.mark_written()
+        elif replica.use_replica():
+            return replica.engine(self.app)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
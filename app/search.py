@@ -0,0 +1,254 @@
+import re
+
+from flask_sqlalchemy import Pagination
+
+from . import db
+
+
+def tokenize(text):
+    return re.findall(r'\w+', text or '')
+
+
+class LikeBackend:
+    # 沒有全文索引的資料庫使用 LIKE 比對，結果依時間排序
+    def create(self, connection, table):
+        pass
+
+    def drop(self, connection, table):
+        pass
+
+    def index(self, connection, table, id, body):
+        pass
+
+    def remove(self, connection, table, id):
+        pass
+
+    def index_many(self, connection, table, rows):
+        pass
+
+    def search(self, model, query, terms, page, per_page):
+        for term in terms:
+            query = query.filter(model.body.ilike(f'%{term}%'))
+        total = query.order_by(None).count()
+        items = query.order_by(model.timestamp.desc()) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+        return items, total
+
+
+class SQLiteBackend:
+    # 每個資料表對應一個 FTS5 索引，rowid 即為資料列的 id
+    @staticmethod
+    def name(table):
+        return f'{table}_search'
+
+    def create(self, connection, table):
+        connection.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.name(table)} '
+            f'USING fts5(body)',
+        )
+
+    def drop(self, connection, table):
+        connection.execute(f'DROP TABLE IF EXISTS {self.name(table)}')
+
+    def index(self, connection, table, id, body):
+        self.remove(connection, table, id)
+        connection.execute(
+            db.text(
+                f'INSERT INTO {self.name(table)} (rowid, body) '
+                f'VALUES (:id, :body)',
+            ),
+            id=id,
+            body=body,
+        )
+
+    def remove(self, connection, table, id):
+        connection.execute(
+            db.text(f'DELETE FROM {self.name(table)} WHERE rowid = :id'),
+            id=id,
+        )
+
+    def index_many(self, connection, table, rows):
+        insert = db.text(
+            f'INSERT INTO {self.name(table)} (rowid, body) '
+            f'VALUES (:id, :body)',
+        )
+        batch = []
+        for id, body in rows:
+            batch.append({'id': id, 'body': body})
+            if len(batch) >= 1000:
+                connection.execute(insert, batch)
+                batch = []
+        if batch:
+            connection.execute(insert, batch)
+
+    def search(self, model, query, terms, page, per_page):
+        # 每個詞都加上引號，避免使用者輸入被當成 FTS5 語法
+        match = ' '.join(f'"{term}"' for term in terms)
+        name = self.name(model.__tablename__)
+        # 總數與結果都經過同一個查詢過濾，兩者才會一致
+        matches = db.text(
+            f'SELECT rowid, rank FROM {name} WHERE {name} MATCH :match',
+        ).bindparams(match=match).columns(
+            db.column('rowid', db.Integer),
+            db.column('rank', db.Float),
+        ).alias('matches')
+        query = query.join(matches, matches.c.rowid == model.id)
+        total = query.order_by(None).count()
+        items = query.order_by(matches.c.rank, model.id) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+        return items, total
+
+
+class PostgresBackend:
+    # 在 body 的 tsvector 運算式上建立 GIN 索引，由資料庫自行維護，
+    # 查詢時使用同一個運算式才會用到索引
+    config = "'english'"
+
+    @staticmethod
+    def name(table):
+        return f'ix_{table}_body_search'
+
+    @classmethod
+    def vector(cls, body):
+        return db.func.to_tsvector(
+            db.literal_column(cls.config),
+            db.func.coalesce(body, db.literal_column("''")),
+        )
+
+    def create(self, connection, table):
+        connection.execute(
+            f'CREATE INDEX IF NOT EXISTS {self.name(table)} ON {table} '
+            f"USING gin (to_tsvector({self.config}, coalesce(body, '')))",
+        )
+
+    def drop(self, connection, table):
+        connection.execute(f'DROP INDEX IF EXISTS {self.name(table)}')
+
+    def index(self, connection, table, id, body):
+        pass
+
+    def remove(self, connection, table, id):
+        pass
+
+    def index_many(self, connection, table, rows):
+        pass
+
+    def match(self, model, terms):
+        # 回傳過濾條件與排序用的 ts_rank
+        vector = self.vector(model.body)
+        query = db.func.plainto_tsquery(
+            db.literal_column(self.config),
+            ' '.join(terms),
+        )
+        return vector.op('@@')(query), db.func.ts_rank(vector, query)
+
+    def search(self, model, query, terms, page, per_page):
+        condition, rank = self.match(model, terms)
+        query = query.filter(condition)
+        total = query.order_by(None).count()
+        items = query.order_by(rank.desc(), model.id) \
+            .limit(per_page).offset((page - 1) * per_page).all()
+        return items, total
+
+
+class SearchIndex:
+    backends = {
+        'sqlite': SQLiteBackend,
+        'postgresql': PostgresBackend,
+        'like': LikeBackend,
+    }
+
+    def __init__(self, app=None):
+        self.backend_name = None
+        self.models = {}
+        db.event.listen(db.metadata, 'after_create', self.on_create_all)
+        db.event.listen(db.metadata, 'before_drop', self.on_drop_all)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend_name = app.config.get('FLASKY_SEARCH_BACKEND')
+
+    def backend(self, bind):
+        # 未指定時依資料庫種類挑選，沒有對應的後端就退回 LIKE
+        name = self.backend_name or bind.dialect.name
+        return self.backends.get(name, LikeBackend)()
+
+    def register(self, model):
+        self.models[model.__tablename__] = model
+        db.event.listen(model, 'after_insert', self.on_change)
+        db.event.listen(model, 'after_update', self.on_change)
+        db.event.listen(model, 'after_delete', self.on_delete)
+
+    @staticmethod
+    def searchable(model):
+        # 透過網頁與 API 建立的留言 disabled 為 NULL，也要能被搜尋
+        if hasattr(model, 'disabled'):
+            return db.or_(model.disabled.is_(None), db.not_(model.disabled))
+        return db.true()
+
+    def include_object(self, object, name, type_, reflected, compare_to):
+        # 讓 Alembic 自動產生遷移時略過索引表與 FTS5 的影子資料表
+        if type_ == 'table' and reflected and compare_to is None:
+            return not any(
+                name.startswith(f'{table}_search')
+                for table in self.models
+            )
+        return True
+
+    def on_create_all(self, target, connection, **kw):
+        backend = self.backend(connection)
+        for table in self.models:
+            backend.create(connection, table)
+
+    def on_drop_all(self, target, connection, **kw):
+        backend = self.backend(connection)
+        for table in self.models:
+            backend.drop(connection, table)
+
+    def on_change(self, mapper, connection, target):
+        backend = self.backend(connection)
+        table = target.__tablename__
+        if getattr(target, 'disabled', False):
+            backend.remove(connection, table, target.id)
+        else:
+            backend.index(connection, table, target.id, target.body)
+
+    def on_delete(self, mapper, connection, target):
+        self.backend(connection).remove(
+            connection,
+            target.__tablename__,
+            target.id,
+        )
+
+    def rebuild(self):
+        with db.engine.begin() as connection:
+            backend = self.backend(connection)
+            for table, model in self.models.items():
+                backend.drop(connection, table)
+                backend.create(connection, table)
+                rows = connection.execute(
+                    db.select([model.id, model.body])
+                    .where(self.searchable(model)),
+                )
+                backend.index_many(connection, table, rows)
+
+    def search(self, model, text, page=1, per_page=20, query=None):
+        if query is None:
+            query = model.query
+        query = query.filter(self.searchable(model))
+        terms = tokenize(text)
+        page = max(page, 1)
+        items, total = [], 0
+        if terms:
+            items, total = self.backend(db.session.get_bind()).search(
+                model,
+                query,
+                terms,
+                page,
+                per_page,
+            )
+        return Pagination(None, page, per_page, total, items)
+
+
+search_index = SearchIndex()
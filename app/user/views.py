@@ -14,6 +14,7 @@ from .forms import EditForm, AdminEditForm
 from .. import db
 from ..decorators import admin_required, permission_required
 from ..models import User, Role, Post, Permission
+from ..replica import read_write
 
 
 @user.route('/<username>')
@@ -21,8 +22,19 @@ def index(username):
     user = User.query.filter_by(username=username).first_or_404()
     if not user:
         abort(404)
-    posts = user.posts.order_by(Post.timestamp.desc()).all()
-    return render_template('user/index.html', user=user, posts=posts)
+    page = request.args.get('page', 1, type=int)
+    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
+        page,
+        per_page=current_app.config['FLASKY_POSTS_PER_PAGE'],
+        error_out=False,
+    )
+    posts = pagination.items
+    return render_template(
+        'user/index.html',
+        user=user,
+        posts=posts,
+        pagination=pagination,
+    )
 
 
 @user.route('/edit', methods=['GET', 'POST'])
@@ -76,6 +88,7 @@ def admin_edit(id):
 
 
 @user.route('/follow/<username>')
+@read_write
 @login_required
 @permission_required(Permission.FOLLOW)
 def follow(username):
@@ -84,17 +97,17 @@ def follow(username):
         flash('Invalid user.')
         return redirect(url_for('.index'))
 
-    if current_user.is_following(user):
+    if not current_user.follow(user):
         flash('You are already following this user.')
         return redirect(url_for('.index', username=username))
 
-    current_user.follow(user)
     db.session.commit()
     flash(f'You are now following {username}.')
     return redirect(url_for('.index', username=username))
 
 
 @user.route('/unfollow/<username>')
+@read_write
 @login_required
 @permission_required(Permission.FOLLOW)
 def unfollow(username):
@@ -103,11 +116,10 @@ def unfollow(username):
         flash('Invalid user.')
         return redirect(url_for('.index'))
 
-    if not current_user.is_following(user):
+    if not current_user.unfollow(user):
         flash('You are not following this user.')
         return redirect(url_for('.index', username=username))
 
-    current_user.unfollow(user)
     db.session.commit()
     flash(f'You are not following {username} anymore.')
     return redirect(url_for('.index', username=username))
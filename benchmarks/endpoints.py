@@ -0,0 +1,177 @@
+"""
+Drive the hot endpoints through the Flask test client against a seeded
+database and report latency percentiles, throughput and queries per
+request as JSON, so runs can be compared across commits.
+
+    $ python -m benchmarks.endpoints --size 1k --requests 200 --output 1k.json
+
+Seeded databases are kept in --data-dir and reused by later runs.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from base64 import b64encode
+from collections import Counter
+
+from flask_sqlalchemy import get_debug_queries
+
+from app import create_app, db
+from app.cache import page_cache
+from app.fake import generate
+from app.models import Role, User, Post
+from app.profiler import percentile
+
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+
+def seed(app, size, seed):
+    posts = SIZES[size]
+    users = max(10, posts // 20)
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        generate(
+            users=users,
+            follows=users * 10,
+            posts=posts,
+            comments=posts,
+            seed=seed,
+        )
+
+
+def endpoints(user_ids, usernames, post_ids):
+    return {
+        'main.index': lambda rng: f'/?page={rng.randint(1, 5)}',
+        'main.show': lambda rng: f'/post/{rng.choice(post_ids)}',
+        'user.index': lambda rng: f'/user/{rng.choice(usernames)}',
+        'api.get_posts': lambda rng: '/api/v1/posts/',
+        'api.get_user_followed_posts': lambda rng:
+            f'/api/v1/users/{rng.choice(user_ids)}/timeline/',
+        'api.get_post_comments': lambda rng:
+            f'/api/v1/posts/{rng.choice(post_ids)}/comments/',
+    }
+
+
+def run(client, url_for, count, warmup, rng, headers, queries):
+    for _ in range(warmup):
+        client.get(url_for(rng), headers=headers)
+
+    latencies = []
+    statuses = Counter()
+    del queries[:]
+    start = time.perf_counter()
+    for _ in range(count):
+        request_start = time.perf_counter()
+        response = client.get(url_for(rng), headers=headers)
+        latencies.append(time.perf_counter() - request_start)
+        statuses[response.status_code] += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        'requests': count,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': sum(latencies) / count * 1000,
+        'throughput_rps': count / elapsed,
+        'queries_per_request': sum(queries) / len(queries) if queries else 0,
+        'status': {str(status): n for status, n in statuses.items()},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', choices=SIZES, default='1k')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument(
+        '--data-dir',
+        default=os.path.join(tempfile.gettempdir(), 'flasky-benchmarks'),
+    )
+    parser.add_argument('--endpoint', action='append', default=None)
+    parser.add_argument('--no-page-cache', action='store_true')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.join(args.data_dir, f'{args.size}-{args.seed}.sqlite3')
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    if args.no_page_cache:
+        app.config['FLASKY_PAGE_CACHE_TTL'] = 0
+        page_cache.init_app(app)
+    if not os.path.exists(path):
+        seed(app, args.size, args.seed)
+
+    with app.app_context():
+        user_ids = [row[0] for row in db.session.query(User.id)]
+        usernames = [row[0] for row in db.session.query(User.username)]
+        post_ids = [row[0] for row in db.session.query(Post.id)]
+        email = db.session.query(User.email).order_by(User.id).first()[0]
+        post_count = len(post_ids)
+
+    # 每個請求各自有 app context，所以這裡的查詢數就是單一請求的數量
+    queries = []
+
+    @app.after_request
+    def count_queries(response):
+        queries.append(len(get_debug_queries()))
+        return response
+
+    headers = {
+        'Authorization': 'Basic ' + b64encode(
+            f'{email}:password'.encode('utf-8'),
+        ).decode('utf-8'),
+        'Accept': 'application/json',
+    }
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    results = {}
+    for endpoint, url_for in endpoints(user_ids, usernames, post_ids).items():
+        if args.endpoint and endpoint not in args.endpoint:
+            continue
+        results[endpoint] = run(
+            client,
+            url_for,
+            args.requests,
+            args.warmup,
+            rng,
+            headers if endpoint.startswith('api.') else {},
+            queries,
+        )
+
+    report = json.dumps({
+        'commit': git_commit(),
+        'size': args.size,
+        'posts': post_count,
+        'seed': args.seed,
+        'page_cache': not args.no_page_cache,
+        'endpoints': results,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
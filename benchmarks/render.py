@@ -0,0 +1,56 @@
+"""
+Compare the shared render pipeline against separate bleach.clean and
+bleach.linkify calls.
+
+    $ python -m benchmarks.render --number 2000
+"""
+import argparse
+import timeit
+
+import bleach
+from markdown import markdown
+
+from app.render import PROFILES, renderers
+
+BODIES = [
+    'A short *comment*.',
+    'Visit http://example.com and [the docs](http://example.com/docs).',
+    '# Title\n\nSome **bold** text\n\n- one\n- two\n\n<script>x</script>',
+    '\n\n'.join(['Lorem ipsum dolor sit amet, *consectetur*.'] * 20),
+]
+
+
+def legacy_render(body, allowed_tags):
+    return bleach.linkify(bleach.clean(
+        markdown(body, output_format='html'),
+        tags=allowed_tags,
+        strip=True,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--number', type=int, default=1000)
+    args = parser.parse_args()
+
+    for profile, allowed_tags in PROFILES.items():
+        renderer = renderers[profile]
+        for body in BODIES:
+            assert renderer.render(body) == legacy_render(body, allowed_tags)
+
+        legacy = timeit.timeit(
+            lambda: [legacy_render(body, allowed_tags) for body in BODIES],
+            number=args.number,
+        )
+        shared = timeit.timeit(
+            lambda: [renderer.render(body) for body in BODIES],
+            number=args.number,
+        )
+        print(
+            f'{profile}: legacy {legacy:.3f}s, shared {shared:.3f}s, '
+            f'speedup {legacy / shared:.2f}x',
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -9,4 +9,9 @@ while true; do
     sleep 5
 done
 
+# 清除上次執行留下的 worker 指標
+if [ -n "$FLASKY_METRICS_DIR" ]; then
+    rm -f "$FLASKY_METRICS_DIR"/metrics-*.json "$FLASKY_METRICS_DIR"/metrics-*.json.tmp
+fi
+
 exec gunicorn -b 0.0.0.0:5000 --access-logfile - --error-logfile - main:app
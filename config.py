@@ -15,10 +15,44 @@ class Config:
     FLASKY_MAIL_SUBJECT_PREFIX = '[Flasky] '
     FLASKY_MAIL_SENDER = 'Flasky Admin <flasky@example.com>'
     FLASKY_ADMIN = os.environ.get('FLASKY_ADMIN')
+    FLASKY_MAIL_WORKERS = 2
+    FLASKY_MAIL_QUEUE_SIZE = 1000
+    FLASKY_MAIL_IDLE_TIMEOUT = 30
     FLASKY_POSTS_PER_PAGE = 20
     FLASKY_FOLLOWERS_PER_PAGE = 50
     FLASKY_COMMENTS_PER_PAGE = 30
     FLASKY_SLOW_DB_QUERY_TIME = 0.5
+    FLASKY_N_PLUS_ONE_THRESHOLD = 10
+    FLASKY_PROFILER_WINDOW = 1000
+    FLASKY_METRICS_DIR = os.environ.get('FLASKY_METRICS_DIR')
+    FLASKY_METRICS_FLUSH_INTERVAL = 1.0
+    FLASKY_METRICS_TOKEN = os.environ.get('FLASKY_METRICS_TOKEN')
+    FLASKY_METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+    FLASKY_TIMELINE_FANOUT_LIMIT = 1000
+    FLASKY_RENDER_CACHE_SIZE = 1024
+    FLASKY_ROLE_CACHE_TTL = 300
+    FLASKY_USER_CACHE_TTL = 30
+    FLASKY_USER_CACHE_SIZE = 10000
+    FLASKY_FOLLOW_GRAPH_DIR = os.environ.get('FLASKY_FOLLOW_GRAPH_DIR')
+    FLASKY_FOLLOW_GRAPH_TTL = 60
+    FLASKY_LAST_SEEN_FLUSH_INTERVAL = 10
+    FLASKY_LAST_SEEN_STALENESS = 60
+    FLASKY_API_AUTH_CACHE_TTL = 60
+    FLASKY_API_AUTH_CACHE_SIZE = 1024
+    FLASKY_API_BATCH_SIZE = 100
+    FLASKY_API_BATCH_MAX_BYTES = 1024 * 1024
+    FLASKY_API_MULTI_GET_SIZE = 100
+    FLASKY_EXPORT_BATCH_SIZE = 1000
+    FLASKY_SEARCH_BACKEND = os.environ.get('FLASKY_SEARCH_BACKEND')
+    FLASKY_SEARCH_RESULTS_PER_PAGE = 20
+    FLASKY_PAGE_CACHE_DIR = os.environ.get('FLASKY_PAGE_CACHE_DIR')
+    FLASKY_PAGE_CACHE_TTL = 60
+    FLASKY_PAGE_CACHE_SIZE = 1000
+    FLASKY_PAGE_CACHE_LOCK_TIMEOUT = 10
+    FLASKY_FRAGMENT_CACHE_SIZE = 10000
+    FLASKY_REPLICA_DATABASE_URI = os.environ.get('REPLICA_DATABASE_URL')
+    FLASKY_REPLICA_STICKY_DIR = os.environ.get('FLASKY_REPLICA_STICKY_DIR')
+    FLASKY_REPLICA_STICKY_SECONDS = 5
     SSL_REDIRECT = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
@@ -42,6 +76,9 @@ class TestingConfig(Config):
         'TEST_DATABASE_URL',
         'sqlite://',
     )
+    FLASKY_REPLICA_DATABASE_URI = os.environ.get('TEST_REPLICA_DATABASE_URL')
+    # 測試中不在背景建立追隨關係圖，需要時直接呼叫 refresh()
+    FLASKY_FOLLOW_GRAPH_TTL = 0
 
 
 class ProductionConfig(Config):
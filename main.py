@@ -6,7 +6,19 @@ from dotenv import load_dotenv
 from flask_migrate import Migrate, upgrade
 
 from app import create_app, db
-from app.models import User, Role, Permission, Follow, Post, Comment
+from app.export import export_query, export_rows
+from app.search import search_index
+from app.models import (
+    User,
+    Role,
+    Permission,
+    Follow,
+    Post,
+    Comment,
+    Timeline,
+    verify_counters,
+    rebuild_counters,
+)
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 if os.path.exists(dotenv_path):
@@ -20,7 +32,7 @@ if os.environ.get('FLASKY_COVERAGE'):
     COV.start()
 
 app = create_app(os.getenv('FLASK_CONFIG', 'default'))
-migrate = Migrate(app, db)
+migrate = Migrate(app, db, include_object=search_index.include_object)
 
 
 @app.shell_context_processor
@@ -33,6 +45,7 @@ def make_shell_context():
         Follow=Follow,
         Post=Post,
         Comment=Comment,
+        Timeline=Timeline,
     )
 
 
@@ -104,3 +117,120 @@ def deploy():
 
     # 確認所有使用者都追隨他們自己
     User.add_self_follows()
+
+
+@app.cli.command()
+@click.option(
+    '--rebuild/--verify',
+    default=False,
+    help='Rebuild the counters instead of only verifying them.',
+)
+def counters(rebuild):
+    """
+    Verify or rebuild the denormalized counters
+    """
+    if rebuild:
+        rebuild_counters()
+
+    for column, mismatches in verify_counters().items():
+        print(f'{column}: {mismatches} mismatched rows')
+
+
+@app.cli.command()
+@click.argument('name', type=click.Choice(['users', 'posts', 'comments']))
+@click.option(
+    '--since-id',
+    type=int,
+    default=None,
+    help='Only export rows with an id greater than this checkpoint.',
+)
+@click.option(
+    '--start',
+    type=click.DateTime(),
+    default=None,
+    help='Only export rows created at or after this time.',
+)
+@click.option(
+    '--end',
+    type=click.DateTime(),
+    default=None,
+    help='Only export rows created before this time.',
+)
+@click.option(
+    '--output',
+    type=click.File('w'),
+    default='-',
+    help='File to write the NDJSON export to.',
+)
+def export(name, since_id, start, end, output):
+    """
+    Export a table as newline-delimited JSON
+    """
+    query = export_query(name, since_id=since_id, start=start, end=end)
+    for line in export_rows(query):
+        output.write(line)
+
+
+@app.cli.command()
+def reindex():
+    """
+    Rebuild the full-text search index
+    """
+    search_index.rebuild()
+
+
+@app.cli.command()
+@click.option('--users', default=100, help='Number of users to create.')
+@click.option('--follows', default=500, help='Number of follows to create.')
+@click.option('--posts', default=1000, help='Number of posts to create.')
+@click.option(
+    '--comments',
+    default=2000,
+    help='Number of comments to create.',
+)
+@click.option(
+    '--seed',
+    type=int,
+    default=None,
+    help='Random seed for a reproducible dataset.',
+)
+@click.option(
+    '--workers',
+    type=int,
+    default=None,
+    help='Processes used to render Markdown.',
+)
+def fake(users, follows, posts, comments, seed, workers):
+    """
+    Fill the database with fake data
+    """
+    from app.fake import generate
+    generate(
+        users=users,
+        follows=follows,
+        posts=posts,
+        comments=comments,
+        seed=seed,
+        workers=workers,
+    )
+
+
+@app.cli.command()
+@click.option(
+    '--verbose',
+    is_flag=True,
+    help='Print the full query plans.',
+)
+def indexes(verbose):
+    """
+    Check that the hot queries use their indexes
+    """
+    from app.explain import check_indexes
+    for name, result in check_indexes().items():
+        if result['used'] is None:
+            print(f'{name}: {result["index"]} unsupported')
+            continue
+        status = 'ok' if result['used'] else 'MISSING'
+        print(f'{name}: {result["index"]} {status}')
+        if verbose or not result['used']:
+            print(result['plan'])
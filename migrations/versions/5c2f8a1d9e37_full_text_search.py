@@ -0,0 +1,40 @@
+"""full text search
+
+Revision ID: 5c2f8a1d9e37
+Revises: b7e29d4f0a63
+Create Date: 2026-10-18 21:32:41.508217
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2f8a1d9e37'
+down_revision = 'b7e29d4f0a63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 只有 SQLite 使用 FTS5 索引，PostgreSQL 的索引在之後的遷移中建立
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('CREATE VIRTUAL TABLE posts_search USING fts5(body)')
+    op.execute(
+        'INSERT INTO posts_search (rowid, body) SELECT id, body FROM posts',
+    )
+    op.execute('CREATE VIRTUAL TABLE comments_search USING fts5(body)')
+    op.execute(
+        'INSERT INTO comments_search (rowid, body) '
+        'SELECT id, body FROM comments '
+        'WHERE disabled IS NULL OR NOT disabled',
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+
+    op.execute('DROP TABLE comments_search')
+    op.execute('DROP TABLE posts_search')
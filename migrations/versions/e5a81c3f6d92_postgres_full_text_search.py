@@ -0,0 +1,36 @@
+"""postgres full text search
+
+Revision ID: e5a81c3f6d92
+Revises: 9e4b1f7c2a65
+Create Date: 2026-10-19 14:06:52.318740
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5a81c3f6d92'
+down_revision = '9e4b1f7c2a65'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # PostgreSQL 在 body 的 tsvector 運算式上建立 GIN 索引，
+    # 運算式需與 PostgresBackend 查詢時使用的一致
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in ('posts', 'comments'):
+        op.execute(
+            f'CREATE INDEX ix_{table}_body_search ON {table} '
+            f"USING gin (to_tsvector('english', coalesce(body, '')))",
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in ('comments', 'posts'):
+        op.execute(f'DROP INDEX ix_{table}_body_search')
@@ -1,10 +1,19 @@
+import io
 import json
 import re
 import unittest
 from base64 import b64encode
+from datetime import datetime, timedelta
+
+from flask_sqlalchemy import get_debug_queries
+from sqlalchemy.dialects import postgresql
 
 from app import create_app, db
-from app.models import Role, User, Post, Comment
+from app.api.authentication import credential_cache
+from app.models import (
+    Role, User, Post, Comment, TableVersion, last_seen_buffer,
+)
+from app.search import search_index
 
 
 class APITestCase(unittest.TestCase):
@@ -327,3 +336,528 @@ class APITestCase(unittest.TestCase):
         json_response = json.loads(response.get_data(as_text=True))
         self.assertIsNotNone(json_response.get('comments'))
         self.assertEqual(json_response.get('count', 0), 2)
+
+    def test_cursor_pagination(self):
+        # add a user with more posts than fit in one page
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        db.session.add(user)
+        timestamp = datetime(2021, 1, 1)
+        for i in range(25):
+            db.session.add(Post(
+                body=f'post {i}',
+                author=user,
+                timestamp=timestamp + timedelta(minutes=i // 2),
+            ))
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # walk forward with the cursor
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 25)
+        self.assertIsNone(json_response['prev'])
+        first_page = [post['body'] for post in json_response['posts']]
+        self.assertEqual(first_page[0], 'post 24')
+        self.assertEqual(len(first_page), 20)
+
+        response = self.client.get(json_response['next'], headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 25)
+        self.assertIsNone(json_response['next'])
+        second_page = [post['body'] for post in json_response['posts']]
+        self.assertEqual(len(second_page), 5)
+        self.assertEqual(
+            set(first_page) | set(second_page),
+            {f'post {i}' for i in range(25)},
+        )
+
+        # walk back to the first page
+        response = self.client.get(json_response['prev'], headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            [post['body'] for post in json_response['posts']],
+            first_page,
+        )
+        self.assertIsNone(json_response['prev'])
+
+        # page numbers still work
+        response = self.client.get('/api/v1/posts/?page=2', headers=headers)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            [post['body'] for post in json_response['posts']],
+            second_page,
+        )
+
+        # bad cursor
+        response = self.client.get(
+            '/api/v1/posts/?cursor=bogus',
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_credential_cache(self):
+        # add a user
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        db.session.add(user)
+        db.session.commit()
+
+        # repeated calls skip the password hash
+        for _ in range(3):
+            response = self.client.get(
+                '/api/v1/posts/',
+                headers=self.get_api_headers('john@example.com', 'cat'),
+            )
+            self.assertEqual(response.status_code, 200)
+        stats = credential_cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['size'], 1)
+
+        # same for tokens
+        response = self.client.post(
+            '/api/v1/tokens/',
+            headers=self.get_api_headers('john@example.com', 'cat'),
+        )
+        token = json.loads(response.get_data(as_text=True))['token']
+        for _ in range(2):
+            response = self.client.get(
+                '/api/v1/posts/',
+                headers=self.get_api_headers(token, ''),
+            )
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(credential_cache.stats()['hits'], 4)
+
+        # a password change invalidates the cached credentials
+        user.password = 'dog'
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers('john@example.com', 'cat'),
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=self.get_api_headers('john@example.com', 'dog'),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get(self):
+        # add a user and a post
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        post = Post(body='body of the post', author=user)
+        db.session.add_all([user, post])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # a matching ETag returns 304 without a body
+        for url in [f'/api/v1/posts/{post.id}', '/api/v1/posts/']:
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertIsNotNone(response.headers.get('Last-Modified'))
+            response = self.client.get(
+                url,
+                headers=dict(headers, **{'If-None-Match': etag}),
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.get_data(), b'')
+
+        # so does an If-Modified-Since that is not older than the row
+        response = self.client.get(f'/api/v1/posts/{post.id}', headers=headers)
+        response = self.client.get(
+            f'/api/v1/posts/{post.id}',
+            headers=dict(headers, **{
+                'If-Modified-Since': response.headers['Last-Modified'],
+            }),
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # a new comment changes the post's comment_count and its ETag
+        response = self.client.get(f'/api/v1/posts/{post.id}', headers=headers)
+        etag = response.headers['ETag']
+        db.session.add(Comment(body='a comment', author=user, post=post))
+        db.session.commit()
+        response = self.client.get(
+            f'/api/v1/posts/{post.id}',
+            headers=dict(headers, **{'If-None-Match': etag}),
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['comment_count'], 1)
+
+        # missing resources are still 404
+        response = self.client.get('/api/v1/posts/12345', headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+        # 清單的版本只讀取一列，刪除與 Core 層的更新也會改變 ETag
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        etag = response.headers['ETag']
+        before = len(get_debug_queries())
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=dict(headers, **{'If-None-Match': etag}),
+        )
+        self.assertEqual(response.status_code, 304)
+        statements = [
+            query.statement for query in get_debug_queries()[before:]
+        ]
+        self.assertEqual(
+            [sql for sql in statements if 'posts' in sql],
+            [],
+        )
+        db.session.add(Post(body='another post', author=user))
+        db.session.commit()
+        response = self.client.get('/api/v1/posts/', headers=headers)
+        etag = response.headers['ETag']
+        db.session.delete(Post.query.filter_by(body='another post').first())
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/posts/',
+            headers=dict(headers, **{'If-None-Match': etag}),
+        )
+        self.assertEqual(response.status_code, 200)
+
+        url = f'/api/v1/users/?ids={user.id}'
+        etag = self.client.get(url, headers=headers).headers['ETag']
+        last_seen_buffer.record(user.id, datetime.utcnow())
+        last_seen_buffer.flush()
+        response = self.client.get(
+            url,
+            headers=dict(headers, **{'If-None-Match': etag}),
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # 版本在提交之後才遞增，復原的寫入不會改變版本
+        versions, _ = TableVersion.current('posts')
+        db.session.add(Post(body='rolled back', author=user))
+        db.session.flush()
+        self.assertEqual(TableVersion.current('posts')[0], versions)
+        db.session.rollback()
+        self.assertEqual(TableVersion.current('posts')[0], versions)
+        db.session.add(Post(body='committed', author=user))
+        db.session.commit()
+        self.assertEqual(
+            TableVersion.current('posts')[0],
+            [versions[0] + 1],
+        )
+
+    def test_batch_create(self):
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        db.session.add(user)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # 全部成功
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            data=json.dumps([{'body': 'first'}, {'body': 'second *post*'}]),
+        )
+        self.assertEqual(response.status_code, 201)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['created'], 2)
+        self.assertEqual(
+            json_response['results'][1]['item']['body_html'],
+            '<p>second <em>post</em></p>',
+        )
+        self.assertEqual(Post.query.count(), 2)
+        self.assertEqual(User.query.get(user.id).post_count, 2)
+
+        # 部分項目有誤時逐項回報
+        post = Post.query.first()
+        response = self.client.post(
+            f'/api/v1/posts/{post.id}/comments/batch',
+            headers=headers,
+            data=json.dumps([{'body': 'good'}, {'body': ''}, 'bad']),
+        )
+        self.assertEqual(response.status_code, 207)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            [result['status'] for result in json_response['results']],
+            [201, 400, 400],
+        )
+        self.assertEqual(json_response['failed'], 2)
+        self.assertEqual(Comment.query.count(), 1)
+
+        # 超過數量或大小限制
+        self.app.config['FLASKY_API_BATCH_SIZE'] = 2
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            data=json.dumps([{'body': 'post'}] * 3),
+        )
+        self.assertEqual(response.status_code, 413)
+        self.app.config['FLASKY_API_BATCH_MAX_BYTES'] = 10
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            data=json.dumps([{'body': 'a long post body'}]),
+        )
+        self.assertEqual(response.status_code, 413)
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            input_stream=io.BytesIO(
+                json.dumps([{'body': 'a long post body'}]).encode('utf-8'),
+            ),
+            environ_overrides={
+                'wsgi.input_terminated': True,
+                'CONTENT_LENGTH': '',
+            },
+        )
+        self.assertEqual(response.status_code, 413)
+        self.app.config['FLASKY_API_BATCH_MAX_BYTES'] = 1024
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            data='[{"body": ',
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/v1/posts/batch',
+            headers=headers,
+            data=json.dumps({}),
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Post.query.count(), 2)
+
+    def test_multi_get(self):
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        posts = [Post(body=f'post {i}', author=user) for i in range(3)]
+        db.session.add_all([user] + posts)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # 依請求順序回傳，找不到的 id 逐項回報
+        ids = [posts[2].id, 999, posts[0].id]
+        response = self.client.get(
+            '/api/v1/posts/?ids=' + ','.join(str(id) for id in ids),
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            [result['id'] for result in json_response['results']],
+            ids,
+        )
+        self.assertEqual(json_response['results'][0]['item']['body'], 'post 2')
+        self.assertEqual(json_response['results'][1]['status'], 404)
+        self.assertEqual(json_response['missing'], [999])
+
+        response = self.client.get(
+            f'/api/v1/users/?ids={user.id}',
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(
+            json_response['results'][0]['item']['username'],
+            user.username,
+        )
+
+        response = self.client.get('/api/v1/comments/?ids=1', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['missing'], [1])
+
+        for url in ('/api/v1/posts/?ids=a,b', '/api/v1/users/'):
+            response = self.client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_export(self):
+        role = Role.query.filter_by(name='Administrator').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        now = datetime.utcnow()
+        posts = [
+            Post(
+                body=f'post {i}',
+                author=user,
+                timestamp=now - timedelta(days=3 - i),
+            )
+            for i in range(3)
+        ]
+        db.session.add_all([user] + posts)
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        response = self.client.get('/api/v1/export/posts', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        rows = [
+            json.loads(line)
+            for line in response.get_data(as_text=True).splitlines()
+        ]
+        self.assertEqual([row['body'] for row in rows], [
+            'post 0', 'post 1', 'post 2',
+        ])
+
+        # 從檢查點接續匯出，並以時間範圍篩選
+        response = self.client.get(
+            f'/api/v1/export/posts?since_id={rows[0]["id"]}'
+            f'&end={(now - timedelta(days=1, hours=12)).isoformat()}',
+            headers=headers,
+        )
+        rows = [
+            json.loads(line)
+            for line in response.get_data(as_text=True).splitlines()
+        ]
+        self.assertEqual([row['body'] for row in rows], ['post 1'])
+
+        response = self.client.get(
+            '/api/v1/export/users',
+            headers=headers,
+        )
+        row = json.loads(response.get_data(as_text=True))
+        self.assertNotIn('password_hash', row)
+        self.assertEqual(row['username'], user.username)
+
+        response = self.client.get('/api/v1/export/roles', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            '/api/v1/export/posts?start=yesterday',
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_search(self):
+        role = Role.query.filter_by(name='User').first()
+        user = User(
+            email='john@example.com',
+            password='cat',
+            confirmed=True,
+            role=role,
+        )
+        post = Post(body='flask search with sqlite', author=user)
+        db.session.add_all([
+            user,
+            post,
+            Post(body='search only', author=user),
+            Post(body='nothing here', author=user),
+        ])
+        db.session.commit()
+        headers = self.get_api_headers('john@example.com', 'cat')
+
+        # 符合越多詞的結果排在越前面
+        response = self.client.get(
+            '/api/v1/search/posts?q=sqlite+search',
+            headers=headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 1)
+        self.assertEqual(
+            json_response['posts'][0]['body'],
+            'flask search with sqlite',
+        )
+        response = self.client.get(
+            '/api/v1/search/posts?q=search',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 2)
+
+        # 索引隨著修改、刪除與停用留言更新
+        post.body = 'renamed'
+        comment = Comment(body='a searchable comment', author=user, post=post)
+        db.session.add_all([post, comment])
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/search/posts?q=sqlite',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 0)
+        response = self.client.get(
+            '/api/v1/search/comments?q=searchable',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 1)
+        self.assertEqual(
+            [item['body'] for item in json_response['comments']],
+            ['a searchable comment'],
+        )
+
+        comment.disabled = True
+        db.session.add(comment)
+        db.session.commit()
+        response = self.client.get(
+            '/api/v1/search/comments?q=searchable',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 0)
+        self.assertEqual(json_response['comments'], [])
+
+        # 重建索引後結果不變
+        search_index.rebuild()
+        response = self.client.get(
+            '/api/v1/search/posts?q=search',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 1)
+        self.assertEqual(len(json_response['posts']), 1)
+
+        # 重建索引保留 disabled 為 NULL 的留言
+        comment.disabled = None
+        db.session.add(comment)
+        db.session.commit()
+        search_index.rebuild()
+        response = self.client.get(
+            '/api/v1/search/comments?q=searchable',
+            headers=headers,
+        )
+        json_response = json.loads(response.get_data(as_text=True))
+        self.assertEqual(json_response['count'], 1)
+        self.assertEqual(len(json_response['comments']), 1)
+
+    def test_search_postgres_query(self):
+        # PostgreSQL 的查詢使用與 GIN 索引相同的運算式，並依 ts_rank 排序
+        backend = search_index.backends['postgresql']()
+        condition, rank = backend.match(Post, ['flask', 'search'])
+        sql = str(
+            Post.query.filter(condition).order_by(rank.desc())
+            .statement.compile(dialect=postgresql.dialect()),
+        )
+        self.assertIn(
+            "to_tsvector('english', coalesce(posts.body, '')) @@ "
+            "plainto_tsquery('english',",
+            sql,
+        )
+        self.assertIn('ORDER BY ts_rank(', sql)
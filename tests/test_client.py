@@ -1,8 +1,17 @@
+import glob
+import os
 import re
+import tempfile
+import threading
+import time
 import unittest
 
+from flask_sqlalchemy import get_debug_queries
+
 from app import create_app, db
-from app.models import Role, User
+from app.cache import PageCache, page_cache, fragment_cache
+from app.profiler import query_profiler, statement_shape
+from app.models import Role, User, Post, Comment, user_cache
 
 
 class ClientTestCase(unittest.TestCase):
@@ -68,3 +77,239 @@ class ClientTestCase(unittest.TestCase):
         self.assertTrue(
             'You have been logged out' in response.get_data(as_text=True),
         )
+
+    def add_posts(self, start, count):
+        for i in range(start, start + count):
+            user = User(
+                email=f'user{i}@example.com',
+                username=f'user{i}',
+                password='cat',
+            )
+            post = Post(body=f'post {i}', author=user)
+            comment = Comment(
+                body=f'comment {i}',
+                author=user,
+                post=Post.query.get(1) or post,
+            )
+            db.session.add_all([user, post, comment])
+        db.session.commit()
+        db.session.remove()
+
+    def count_queries(self, url):
+        before = len(get_debug_queries())
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(get_debug_queries()) - before
+
+    def test_list_query_count(self):
+        # 每頁的查詢次數不應隨著項目數量增加
+        self.add_posts(0, 2)
+        index_queries = self.count_queries('/')
+        show_queries = self.count_queries('/post/1')
+        user_queries = self.count_queries('/user/user0')
+
+        self.add_posts(2, 5)
+        self.assertEqual(self.count_queries('/'), index_queries)
+        self.assertEqual(self.count_queries('/post/1'), show_queries)
+        self.assertEqual(self.count_queries('/user/user0'), user_queries)
+
+    def test_user_cache(self):
+        user = User(
+            email='john@example.com',
+            username='john',
+            password='cat',
+            confirmed=True,
+        )
+        db.session.add(user)
+        db.session.commit()
+        self.client.post('/auth/login', data={
+            'email': 'john@example.com',
+            'password': 'cat',
+        })
+
+        # 之後的請求都從快取載入使用者
+        for _ in range(3):
+            response = self.client.get('/')
+            self.assertTrue(re.search(
+                r'Hello,\s+john\s+!',
+                response.get_data(as_text=True),
+            ))
+        stats = user_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+
+        # 修改密碼後快取失效
+        response = self.client.post('/auth/change-password', data={
+            'old_password': 'cat',
+            'password': 'dog',
+            'password2': 'dog',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(user_cache.stats()['size'], 0)
+        response = self.client.get('/')
+        self.assertEqual(user_cache.stats()['misses'], 2)
+
+        # 快照過期後，提交前填回的快照在提交後仍會移除
+        user = User.query.filter_by(username='john').first()
+        user_cache.invalidate(user.id)
+        user.name = 'John'
+        db.session.flush()
+        user_cache.get(user.id)
+        self.assertEqual(user_cache.stats()['misses'], 3)
+        db.session.commit()
+        self.assertEqual(user_cache.stats()['size'], 0)
+        user.name = 'Johnny'
+        db.session.flush()
+        db.session.rollback()
+        user_cache.get(user.id)
+        self.assertEqual(user_cache.stats()['size'], 1)
+
+    def test_query_profiler(self):
+        self.add_posts(0, 3)
+        self.client.get('/')
+        self.client.get('/user/user0')
+        stats = query_profiler.stats()
+        self.assertEqual(stats['main.index']['requests'], 1)
+        self.assertTrue(stats['main.index']['queries']['max'] > 0)
+        self.assertEqual(stats['user.index']['requests'], 1)
+
+        # 同一個樣板重複執行就發出 N+1 警告
+        query_profiler.repeat_threshold = 0
+        with self.assertLogs(self.app.logger, 'WARNING') as logs:
+            self.client.get('/user/user0')
+        self.assertTrue(
+            any('Possible N+1 query' in line for line in logs.output),
+        )
+
+    def test_page_cache(self):
+        self.add_posts(0, 2)
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+
+        # 匿名使用者再次瀏覽時直接回傳快取，不查詢資料庫
+        self.assertEqual(self.count_queries('/'), 0)
+        self.assertTrue(self.count_queries('/post/1') > 0)
+        self.assertEqual(self.count_queries('/post/1'), 0)
+
+        # 新增留言後快取失效
+        comment = Comment(
+            body='new comment',
+            post=Post.query.get(1),
+            author=User.query.first(),
+        )
+        db.session.add(comment)
+        generation = page_cache.generation()
+        db.session.flush()
+        self.assertEqual(page_cache.generation(), generation)
+        db.session.commit()
+        self.assertNotEqual(page_cache.generation(), generation)
+        response = self.client.get('/post/1')
+        self.assertTrue('new comment' in response.get_data(as_text=True))
+        self.assertTrue(self.count_queries('/') > 0)
+
+        # 復原的交易不會讓快取失效
+        generation = page_cache.generation()
+        db.session.add(Comment(body='dropped', post=Post.query.get(1)))
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(page_cache.generation(), generation)
+
+        # 其他查詢參數與同一頁共用快取
+        self.assertEqual(self.count_queries('/?x=1'), 0)
+
+    def test_page_cache_directory(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PageCache()
+            self.app.config['FLASKY_PAGE_CACHE_DIR'] = directory
+            cache.init_app(self.app)
+            generation = cache.generation()
+
+            # 同一時間只有一個請求能重新產生頁面
+            self.assertTrue(cache.acquire('key'))
+            self.assertFalse(cache.acquire('key'))
+            cache.set('key', {'data': 'page', 'mimetype': 'text/html'})
+            cache.release('key')
+            self.assertEqual(cache.wait('key')['data'], 'page')
+
+            # 其他 worker 透過同一個目錄看到失效
+            other = PageCache()
+            other.init_app(self.app)
+            self.assertNotEqual(cache.generation(), generation)
+            self.assertEqual(other.generation(), cache.generation())
+
+            # 目錄中的頁面數量不超過上限
+            cache.maxsize = 2
+            for key in ['a', 'b', 'c', 'd']:
+                cache.set(key, {'data': key, 'mimetype': 'text/html'})
+            self.assertEqual(
+                len(glob.glob(os.path.join(directory, 'page-*.json'))),
+                2,
+            )
+            self.assertIsNone(cache.get('key'))
+
+    def test_page_cache_wait(self):
+        # 持有鎖的請求沒有存入頁面時，等待的請求隨即結束
+        with tempfile.TemporaryDirectory() as directory:
+            for path in [None, directory]:
+                cache = PageCache()
+                self.app.config['FLASKY_PAGE_CACHE_DIR'] = path
+                cache.init_app(self.app)
+                self.assertTrue(cache.acquire('key'))
+                timer = threading.Timer(0.2, cache.release, ['key'])
+                timer.start()
+                start = time.monotonic()
+                self.assertIsNone(cache.wait('key'))
+                self.assertLess(time.monotonic() - start, 5)
+                timer.join()
+                self.assertIsNone(cache.wait('key'))
+
+    def test_fragment_cache(self):
+        page_cache.ttl = 0
+        self.add_posts(0, 2)
+        self.client.get('/')
+        self.assertEqual(fragment_cache.stats()['misses'], 2)
+
+        # 第二次瀏覽時直接使用已渲染的項目
+        response = self.client.get('/')
+        self.assertEqual(fragment_cache.stats()['hits'], 2)
+        self.assertTrue('post 1' in response.get_data(as_text=True))
+
+        # 修改文章後產生新版本的項目
+        post = Post.query.get(1)
+        post.body = 'edited post'
+        db.session.add(post)
+        db.session.commit()
+        response = self.client.get('/')
+        self.assertEqual(fragment_cache.stats()['misses'], 3)
+        self.assertTrue('edited post' in response.get_data(as_text=True))
+
+        # 每個項目都是完整的 HTML，作者的計數器變動不會讓項目失效
+        for html in fragment_cache._entries.values():
+            self.assertEqual(html.count('<div'), html.count('</div>'))
+        author = post.author
+        author.post_count += 1
+        db.session.add(author)
+        db.session.commit()
+        self.client.get('/')
+        self.assertEqual(fragment_cache.stats()['misses'], 3)
+
+    def test_search(self):
+        self.add_posts(0, 3)
+        response = self.client.get('/search?q=post+1')
+        self.assertEqual(response.status_code, 200)
+        data = response.get_data(as_text=True)
+        self.assertTrue('1 posts found' in data)
+        self.assertTrue('post 1' in data)
+
+        response = self.client.get('/search?q=')
+        self.assertTrue('0 posts found' in response.get_data(as_text=True))
+
+    def test_statement_shape(self):
+        self.assertEqual(
+            statement_shape('SELECT * FROM posts\nWHERE id IN (?, ?, ?)'),
+            'SELECT * FROM posts WHERE id IN (?)',
+        )
+        self.assertEqual(
+            statement_shape('SELECT * FROM users WHERE id = %(id_1)s'),
+            'SELECT * FROM users WHERE id = ?',
+        )
@@ -0,0 +1,143 @@
+import socketserver
+import threading
+import unittest
+
+from flask_mail import Message
+
+from app import create_app, db, mail
+from app.email import email_queue, send_email
+from app.models import Role, User
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    lines.append(line)
+                self.server.messages.append(b''.join(lines))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = SMTPServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True) \
+            .start()
+
+        self.app = create_app('testing')
+        self.app.config.update(
+            MAIL_SERVER='127.0.0.1',
+            MAIL_PORT=self.server.server_address[1],
+            MAIL_USE_TLS=False,
+            MAIL_USERNAME=None,
+            MAIL_SUPPRESS_SEND=False,
+            FLASKY_MAIL_WORKERS=1,
+        )
+        mail.init_app(self.app)
+        email_queue.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        email_queue.shutdown()
+        self.server.shutdown()
+        self.server.server_close()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_send_over_one_connection(self):
+        user = User(email='john@example.com', username='john')
+        with self.app.test_request_context():
+            for i in range(5):
+                send_email(
+                    'john@example.com',
+                    'Confirm Your Account',
+                    'auth/mail/confirm',
+                    user=user,
+                    token=f'token-{i}',
+                )
+        email_queue.drain()
+
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 1)
+        self.assertIn(b'token-4', self.server.messages[-1])
+        stats = email_queue.stats()
+        self.assertEqual(stats['sent'], 5)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['queue_depth'], 0)
+
+    def test_shutdown_drains_queue(self):
+        user = User(email='john@example.com', username='john')
+        with self.app.test_request_context():
+            for i in range(3):
+                send_email(
+                    'john@example.com',
+                    'Reset Your Password',
+                    'auth/mail/reset_password',
+                    user=user,
+                    token=f'token-{i}',
+                )
+        email_queue.shutdown()
+        self.assertEqual(len(self.server.messages), 3)
+        self.assertEqual(email_queue.stats()['workers'], 0)
+
+    def test_bad_message_keeps_worker_alive(self):
+        # 標頭含換行會讓 Flask-Mail 拋出 BadHeaderError
+        bad = Message(
+            'Bad\nSubject',
+            sender='flasky@example.com',
+            recipients=['john@example.com'],
+            body='bad',
+        )
+        good = Message(
+            'Good Subject',
+            sender='flasky@example.com',
+            recipients=['john@example.com'],
+            body='good',
+        )
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            email_queue.enqueue(bad)
+            email_queue.drain()
+        email_queue.enqueue(good)
+        email_queue.drain()
+
+        self.assertEqual(len(self.server.messages), 1)
+        stats = email_queue.stats()
+        self.assertEqual(stats['sent'], 1)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['workers'], 1)
@@ -0,0 +1,40 @@
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from app.explain import check_indexes
+from app.models import Post
+
+
+class ExplainTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_hot_queries_use_indexes(self):
+        # TEST_DATABASE_URL 指向 Postgres 時也會檢查同樣的查詢
+        for name, result in check_indexes().items():
+            self.assertTrue(result['used'], f'{name}:\n{result["plan"]}')
+
+    def test_session_untouched(self):
+        # 檢查在獨立的交易中執行，session 中尚未提交的內容仍保留
+        post = Post(body='pending')
+        db.session.add(post)
+        check_indexes()
+        self.assertIn(post, db.session)
+        db.session.commit()
+        self.assertEqual(Post.query.count(), 1)
+
+    def test_unsupported_dialect(self):
+        with mock.patch.object(db.engine.dialect, 'name', 'mysql'):
+            results = check_indexes()
+        for result in results.values():
+            self.assertIsNone(result['used'])
+            self.assertIsNone(result['plan'])
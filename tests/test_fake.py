@@ -0,0 +1,88 @@
+import unittest
+
+from app import create_app, db, fake
+from app.models import Role, User, Post, Comment, Follow, verify_counters
+from app.search import search_index
+
+
+class FakeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def generate(self, seed):
+        fake.generate(
+            users=20,
+            follows=60,
+            posts=50,
+            comments=80,
+            seed=seed,
+            workers=1,
+            batch_size=16,
+        )
+
+    def test_generate(self):
+        self.generate(seed=1)
+        self.assertEqual(User.query.count(), 20)
+        self.assertEqual(Follow.query.count(), 80)
+        self.assertEqual(Post.query.count(), 50)
+        self.assertEqual(Comment.query.count(), 80)
+
+        # 計數欄位、時間軸與搜尋索引都與資料一致
+        self.assertFalse(any(verify_counters().values()))
+        for user in User.query.all():
+            expected = Post.query.join(
+                Follow,
+                Follow.followed_id == Post.author_id,
+            ).filter(Follow.follower_id == user.id).count()
+            self.assertEqual(user.followed_posts.count(), expected)
+        post = Post.query.first()
+        self.assertEqual(post.body_html, f'<p>{post.body}</p>')
+        word = post.body.split()[0].strip('.')
+        self.assertIn(post, search_index.search(Post, word, per_page=50).items)
+
+    def test_seed(self):
+        self.generate(seed=42)
+        users = [
+            (user.username, user.member_since, user.updated_at)
+            for user in User.query.order_by(User.id)
+        ]
+        posts = [
+            (post.body, post.timestamp)
+            for post in Post.query.order_by(Post.id)
+        ]
+        db.drop_all()
+        db.create_all()
+        Role.insert_roles()
+        self.generate(seed=42)
+        self.assertEqual(
+            [
+                (user.username, user.member_since, user.updated_at)
+                for user in User.query.order_by(User.id)
+            ],
+            users,
+        )
+        self.assertEqual(
+            [
+                (post.body, post.timestamp)
+                for post in Post.query.order_by(Post.id)
+            ],
+            posts,
+        )
+
+    def test_process_pool(self):
+        fake.users(5)
+        fake.posts(20, workers=2)
+        self.assertEqual(
+            Post.query.filter(Post.body_html.is_(None)).count(),
+            0,
+        )
+        self.assertFalse(any(verify_counters().values()))
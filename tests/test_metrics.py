@@ -0,0 +1,132 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from app import create_app, db
+from app.metrics import metrics
+from app.models import Role
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        metrics.directory = None
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_metrics_endpoint(self):
+        self.client.get('/')
+        self.client.get('/')
+        self.client.get('/wrong/url')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn(
+            'flasky_http_requests_total'
+            '{endpoint="main.index",method="GET",status="200"} 2.0',
+            text,
+        )
+        self.assertIn(
+            'flasky_http_requests_total'
+            '{endpoint="unknown",method="GET",status="404"} 1.0',
+            text,
+        )
+        self.assertIn(
+            'flasky_http_request_duration_seconds_count'
+            '{endpoint="main.index"} 2',
+            text,
+        )
+        self.assertIn(
+            'flasky_http_request_duration_seconds_bucket'
+            '{endpoint="main.index",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn(
+            'flasky_template_render_seconds_total{endpoint="main.index"}',
+            text,
+        )
+        self.assertIn(
+            'flasky_http_requests_in_progress{endpoint="metrics"} 1',
+            text,
+        )
+        self.assertIsNotNone(re.search(
+            r'flasky_db_queries_per_request'
+            rf'{{endpoint="main.index",pid="{os.getpid()}",quantile="0.5"}} '
+            r'[1-9]',
+            text,
+        ))
+        self.assertIn(
+            'flasky_db_seconds_per_request{endpoint="main.index",'
+            f'pid="{os.getpid()}",quantile="0.95"}}',
+            text,
+        )
+
+    def test_metrics_access(self):
+        # 沒有設定權杖時只允許本機存取
+        response = self.client.get(
+            '/metrics',
+            environ_base={'REMOTE_ADDR': '203.0.113.5'},
+        )
+        self.assertEqual(response.status_code, 403)
+
+        # 設定權杖後必須帶上正確的 Bearer 權杖
+        metrics.token = 'secret'
+        self.addCleanup(setattr, metrics, 'token', None)
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        response = self.client.get(
+            '/metrics',
+            headers={'Authorization': 'Bearer wrong'},
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(
+            '/metrics',
+            headers={'Authorization': 'Bearer secret'},
+            environ_base={'REMOTE_ADDR': '203.0.113.5'},
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_shared_directory(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.directory = directory
+
+        # 另一個 worker 已經寫入的指標
+        with open(os.path.join(directory, 'metrics-999999.json'), 'w') as f:
+            json.dump({
+                'pid': 999999,
+                'counters': [[
+                    'flasky_http_requests_total',
+                    [['endpoint', 'main.index'], ['method', 'GET'],
+                     ['status', 200]],
+                    3,
+                ]],
+                'histograms': [],
+                'in_progress': [[[['endpoint', 'main.index']], 1]],
+            }, f)
+
+        self.client.get('/')
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn(
+            'flasky_http_requests_total'
+            '{endpoint="main.index",method="GET",status="200"} 4.0',
+            text,
+        )
+        # 已結束的 worker 不計入進行中的請求
+        self.assertIn(
+            'flasky_http_requests_in_progress{endpoint="main.index"} 0',
+            text,
+        )
+        self.assertTrue(os.path.exists(
+            os.path.join(directory, f'metrics-{os.getpid()}.json'),
+        ))
@@ -0,0 +1,67 @@
+import unittest
+
+import bleach
+
+from app import create_app, db
+from app.models import Role, User, Post, Comment
+from app.render import PROFILES, renderers, render_cache
+
+
+class RenderCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_repeated_body(self):
+        user = User(email='john@example.com', password='cat')
+        post = Post(body='*same* body', author=user)
+        post2 = Post(body='*same* body', author=user)
+        self.assertEqual(post.body_html, '<p><em>same</em> body</p>')
+        self.assertEqual(post2.body_html, post.body_html)
+        stats = render_cache.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 1)
+
+    def test_tag_profiles(self):
+        # 文章與留言允許的標籤不同，不能共用快取
+        user = User(email='john@example.com', password='cat')
+        post = Post(body='*same* body', author=user)
+        comment = Comment(body='*same* body', author=user, post=post)
+        self.assertEqual(post.body_html, '<p><em>same</em> body</p>')
+        self.assertEqual(comment.body_html, '<em>same</em> body')
+        self.assertEqual(render_cache.stats()['misses'], 2)
+
+    def test_unchanged_body(self):
+        user = User(email='john@example.com', password='cat')
+        post = Post(body='body', author=user)
+        post.body = 'body'
+        stats = render_cache.stats()
+        self.assertEqual(stats['hits'] + stats['misses'], 1)
+
+    def test_eviction(self):
+        render_cache.maxsize = 2
+        for body in ['one', 'two', 'three']:
+            render_cache.render(body, 'post')
+        self.assertEqual(render_cache.stats()['size'], 2)
+        render_cache.render('one', 'post')
+        self.assertEqual(render_cache.stats()['misses'], 4)
+
+    def test_renderer_matches_bleach(self):
+        body = 'See **http://example.com** and <script>alert(1)</script>'
+        for profile, allowed_tags in PROFILES.items():
+            self.assertEqual(
+                renderers[profile].render(body),
+                bleach.linkify(bleach.clean(
+                    renderers[profile].pipeline()[0].reset().convert(body),
+                    tags=allowed_tags,
+                    strip=True,
+                )),
+            )
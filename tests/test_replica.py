@@ -0,0 +1,215 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from base64 import b64encode
+
+from app import create_app, db
+from app.models import Role, User, Post, Follow, user_cache
+from app.replica import ReplicaRouter, replica
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary_path = os.path.join(self.directory.name, 'primary.db')
+        self.replica_path = os.path.join(self.directory.name, 'replica.db')
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = \
+            'sqlite:///' + self.primary_path
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica': 'sqlite:///' + self.replica_path,
+        }
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.replicate()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(bind='replica').dispose()
+        db.engine.dispose()
+        self.app_context.pop()
+        self.directory.cleanup()
+
+    def replicate(self):
+        # 以 SQLite 備份模擬主資料庫同步到副本
+        db.session.commit()
+        db.get_engine(bind='replica').dispose()
+        source = sqlite3.connect(self.primary_path)
+        target = sqlite3.connect(self.replica_path)
+        source.backup(target)
+        source.close()
+        target.close()
+
+    def add_user(self, username):
+        user = User(
+            email=f'{username}@example.com',
+            username=username,
+            password='cat',
+            confirmed=True,
+        )
+        db.session.add(user)
+        db.session.commit()
+        return user
+
+    def login(self, client, username):
+        return client.post('/auth/login', data={
+            'email': f'{username}@example.com',
+            'password': 'cat',
+        })
+
+    def test_routing(self):
+        primary = db.engine
+        replica_engine = db.get_engine(bind='replica')
+        bind = db.session.get_bind
+
+        with self.app.test_request_context('/'):
+            replica.before_request()
+            self.assertEqual(bind(User.__mapper__), replica_engine)
+
+        with self.app.test_request_context('/', method='POST'):
+            replica.before_request()
+            self.assertEqual(bind(User.__mapper__), primary)
+
+        # 明確標示的唯讀與讀寫路由
+        with self.app.test_request_context('/api/v1/tokens/', method='POST'):
+            replica.before_request()
+            self.assertEqual(bind(User.__mapper__), replica_engine)
+        with self.app.test_request_context('/user/follow/john'):
+            replica.before_request()
+            self.assertEqual(bind(User.__mapper__), primary)
+
+        # 寫入後同一個請求的讀取改回主資料庫
+        with self.app.test_request_context('/'):
+            replica.before_request()
+            db.session.execute(User.__table__.update().values(name='john'))
+            self.assertEqual(bind(User.__mapper__), primary)
+        db.session.rollback()
+
+        # 沒有設定副本時全部使用主資料庫
+        binds = self.app.config['SQLALCHEMY_BINDS']
+        self.app.config['SQLALCHEMY_BINDS'] = None
+        with self.app.test_request_context('/'):
+            replica.before_request()
+            self.assertEqual(bind(User.__mapper__), primary)
+        self.app.config['SQLALCHEMY_BINDS'] = binds
+
+    def test_read_your_writes(self):
+        user = self.add_user('john')
+        self.replicate()
+        db.session.add(Post(body='not replicated', author=user))
+        db.session.commit()
+
+        # 匿名的讀取走副本，看不到尚未同步的文章
+        anonymous = self.app.test_client()
+        response = anonymous.get('/user/john')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse('not replicated' in response.get_data(as_text=True))
+
+        # 寫入後同一位使用者的讀取留在主資料庫
+        client = self.app.test_client(use_cookies=True)
+        self.login(client, 'john')
+        response = client.post('/', data={'body': 'fresh post'})
+        self.assertEqual(response.status_code, 302)
+        data = client.get('/user/john').get_data(as_text=True)
+        self.assertTrue('fresh post' in data)
+        self.assertTrue('not replicated' in data)
+        data = anonymous.get('/user/john').get_data(as_text=True)
+        self.assertFalse('fresh post' in data)
+
+        # 超過時限後回到副本，同步之後才看得到
+        replica.clear()
+        data = client.get('/user/john').get_data(as_text=True)
+        self.assertFalse('fresh post' in data)
+        self.replicate()
+        data = client.get('/user/john').get_data(as_text=True)
+        self.assertTrue('fresh post' in data)
+
+    def test_read_your_writes_api(self):
+        self.add_user('john')
+        self.add_user('susan')
+        self.replicate()
+
+        def headers(username):
+            credentials = f'{username}@example.com:cat'.encode('utf-8')
+            return {
+                'Authorization': 'Basic ' + b64encode(credentials)
+                .decode('utf-8'),
+                'Accept': 'application/json',
+                'Content-Type': 'application/json',
+            }
+
+        # 不帶 cookie 的 API 用戶端依驗證的使用者留在主資料庫
+        client = self.app.test_client(use_cookies=False)
+        response = client.post(
+            '/api/v1/posts/',
+            headers=headers('john'),
+            data=json.dumps({'body': 'fresh post'}),
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.headers.get('Set-Cookie'))
+        url = response.headers['Location']
+        response = client.get(url, headers=headers('john'))
+        self.assertEqual(response.status_code, 200)
+
+        # 其他使用者仍然讀取副本
+        response = client.get(url, headers=headers('susan'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_sticky_directory(self):
+        # 設定目錄時，寫入的記錄由所有 worker 共用
+        directory = os.path.join(self.directory.name, 'sticky')
+        self.app.config['FLASKY_REPLICA_STICKY_DIR'] = directory
+        other = ReplicaRouter()
+        other.init_app(self.app)
+        with self.app.test_request_context('/'):
+            self.assertFalse(other.sticky('1'))
+            other.written('1')
+            self.assertTrue(other.sticky('1'))
+            self.assertFalse(other.sticky('2'))
+            self.assertFalse(replica.sticky('1'))
+
+    def test_write_in_get_view(self):
+        self.add_user('john')
+        self.replicate()
+        self.add_user('susan')
+
+        # 會寫入的 GET 路由從主資料庫讀取與寫入
+        client = self.app.test_client(use_cookies=True)
+        self.login(client, 'john')
+        response = client.get('/user/follow/susan', follow_redirects=True)
+        self.assertTrue(
+            'You are now following susan' in response.get_data(as_text=True),
+        )
+        self.assertEqual(Follow.query.count(), 3)
+        self.assertEqual(
+            db.get_engine(bind='replica').scalar(
+                'SELECT count(*) FROM follows',
+            ),
+            1,
+        )
+
+    def test_caches_load_from_primary(self):
+        user = self.add_user('john')
+        self.replicate()
+        db.session.add(Post(body='not replicated', author=user))
+        db.session.commit()
+        susan_id = self.add_user('susan').id
+
+        # 快取的載入不會把副本的舊資料留下來
+        with self.app.test_request_context('/'):
+            replica.before_request()
+            self.assertIsNotNone(user_cache.get(susan_id))
+            self.assertEqual(
+                db.session.get_bind(User.__mapper__),
+                db.get_engine(bind='replica'),
+            )
+        anonymous = self.app.test_client()
+        data = anonymous.get('/').get_data(as_text=True)
+        self.assertTrue('not replicated' in data)
+        data = anonymous.get('/user/john').get_data(as_text=True)
+        self.assertFalse('not replicated' in data)
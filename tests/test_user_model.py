@@ -1,9 +1,26 @@
+import tempfile
 import time
 import unittest
 from datetime import datetime
 
+from flask_sqlalchemy import get_debug_queries
+
 from app import create_app, db
-from app.models import User, Permission, Role, AnonymousUser, Follow
+from app.models import (
+    User,
+    Permission,
+    Role,
+    AnonymousUser,
+    Follow,
+    FollowGraph,
+    Post,
+    Comment,
+    Timeline,
+    verify_counters,
+    rebuild_counters,
+    last_seen_buffer,
+    follow_graph,
+)
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -213,3 +230,254 @@ class UserModelTestCase(unittest.TestCase):
         db.session.delete(user2)
         db.session.commit()
         self.assertEqual(Follow.query.count(), 1)
+
+    def test_follow_graph(self):
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        user.follow(user2)
+        db.session.commit()
+        user_id, user2_id = user.id, user2.id
+
+        # 圖建立前直接查詢資料庫
+        self.assertFalse(follow_graph.stats()['loaded'])
+        self.assertTrue(follow_graph.is_following(user_id, user2_id))
+
+        # 圖載入後，查詢追隨關係不再存取資料庫
+        follow_graph.refresh()
+        before = len(get_debug_queries())
+        self.assertTrue(user.is_following(user2))
+        self.assertFalse(user.is_followed_by(user2))
+        self.assertTrue(user2.is_followed_by(user))
+        self.assertEqual(len(get_debug_queries()), before)
+        stats = follow_graph.stats()
+        self.assertTrue(stats['loaded'])
+        self.assertEqual(stats['users'], 2)
+        self.assertEqual(stats['edges'], 3)
+        self.assertGreater(stats['bytes'], 0)
+
+        # 提交後才更新記憶體中的圖，圖仍是最新的
+        user2.follow(user)
+        db.session.flush()
+        self.assertEqual(follow_graph.stats()['edges'], 3)
+        db.session.commit()
+        self.assertEqual(follow_graph.stats()['edges'], 4)
+        user.unfollow(user2)
+        db.session.commit()
+        before = len(get_debug_queries())
+        self.assertTrue(follow_graph.is_following(user2_id, user_id))
+        self.assertFalse(follow_graph.is_following(user_id, user2_id))
+        self.assertEqual(len(get_debug_queries()), before)
+        self.assertEqual(follow_graph.stats()['edges'], 3)
+
+        # 復原的交易不會留在圖中
+        user.follow(user2)
+        db.session.flush()
+        db.session.rollback()
+        self.assertFalse(user.is_following(user2))
+        self.assertEqual(follow_graph.stats()['edges'], 3)
+
+        # 刪除使用者時一併移除其追隨關係
+        db.session.delete(user2)
+        db.session.commit()
+        self.assertFalse(follow_graph.is_following(user_id, user2_id))
+        self.assertEqual(follow_graph.stats()['users'], 1)
+        self.assertEqual(follow_graph.stats()['edges'], 1)
+
+    def test_follow_graph_across_workers(self):
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        user_id, user2_id = user.id, user2.id
+
+        # 兩個 worker 共用世代檔案
+        with tempfile.TemporaryDirectory() as directory:
+            follow_graph.directory = directory
+            other = FollowGraph()
+            other.directory = directory
+            follow_graph.refresh()
+            other.refresh()
+            self.assertFalse(other.is_following(user_id, user2_id))
+
+            # 另一個 worker 的圖過期，改查資料庫並標記重建
+            user.follow(user2)
+            db.session.commit()
+            before = len(get_debug_queries())
+            self.assertTrue(follow_graph.is_following(user_id, user2_id))
+            self.assertEqual(len(get_debug_queries()), before)
+            self.assertTrue(other.is_following(user_id, user2_id))
+            self.assertEqual(len(get_debug_queries()), before + 1)
+            other.refresh()
+            before = len(get_debug_queries())
+            self.assertTrue(other.is_following(user_id, user2_id))
+            self.assertEqual(len(get_debug_queries()), before)
+            follow_graph.directory = None
+
+    def test_follow_with_stale_graph(self):
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        follow_graph.refresh()
+        self.assertFalse(user.is_following(user2))
+
+        # 模擬繞過 ORM 的寫入，記憶體中的圖還沒更新
+        db.session.execute(Follow.__table__.insert().values(
+            follower_id=user.id,
+            followed_id=user2.id,
+            timestamp=datetime.utcnow(),
+        ))
+        db.session.commit()
+        self.assertFalse(user.is_following(user2))
+
+        # 追隨與取消追隨仍以資料庫為準
+        self.assertFalse(user.follow(user2))
+        self.assertTrue(user.unfollow(user2))
+        db.session.commit()
+        self.assertEqual(user.followed.count(), 1)
+        self.assertFalse(user.unfollow(user2))
+
+        # 明確失效後改查資料庫
+        follow_graph.invalidate()
+        self.assertFalse(user.is_following(user2))
+
+    def test_timeline(self):
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        post = Post(body='first post', author=user2)
+        db.session.add(post)
+        db.session.commit()
+        self.assertEqual(user.followed_posts.count(), 0)
+        self.assertEqual(user2.followed_posts.all(), [post])
+
+        # 追隨時回填既有的文章，新文章則在寫入時推送
+        user.follow(user2)
+        db.session.commit()
+        post2 = Post(body='second post', author=user2)
+        db.session.add(post2)
+        db.session.commit()
+        self.assertEqual(
+            user.followed_posts.order_by(Post.timestamp.asc()).all(),
+            [post, post2],
+        )
+        self.assertEqual(Timeline.query.filter_by(user_id=user.id).count(), 2)
+
+        # 取消追隨時移除該作者的文章
+        user.unfollow(user2)
+        db.session.commit()
+        self.assertEqual(user.followed_posts.count(), 0)
+        self.assertEqual(Timeline.query.filter_by(user_id=user.id).count(), 0)
+
+    def test_timeline_fanout_on_read(self):
+        self.app.config['FLASKY_TIMELINE_FANOUT_LIMIT'] = 1
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        user.follow(user2)
+        db.session.commit()
+
+        # 追隨者超過上限，文章不再推送，改為讀取時合併
+        post = Post(body='popular post', author=user2)
+        db.session.add(post)
+        db.session.commit()
+        db.session.refresh(user2)
+        self.assertTrue(user2.fanout_on_read)
+        self.assertEqual(Timeline.query.filter_by(post_id=post.id).count(), 0)
+        self.assertEqual(user.followed_posts.all(), [post])
+        self.assertEqual(user2.followed_posts.all(), [post])
+
+    def test_counters(self):
+        user = User(email='john@example.com', password='cat')
+        user2 = User(email='susan@example.org', password='dog')
+        db.session.add_all([user, user2])
+        db.session.commit()
+        user.follow(user2)
+        post = Post(body='a post', author=user2)
+        db.session.add(post)
+        db.session.add(Comment(body='a comment', author=user, post=post))
+        db.session.commit()
+        self.assertEqual(user2.post_count, 1)
+        self.assertEqual(user2.follower_count, 2)
+        self.assertEqual(user.followed_count, 2)
+        self.assertEqual(post.comment_count, 1)
+
+        user.unfollow(user2)
+        db.session.commit()
+        self.assertEqual(user2.follower_count, 1)
+        self.assertEqual(user.followed_count, 1)
+
+        # 修正被改壞的計數
+        self.assertFalse(any(verify_counters().values()))
+        post.comment_count = 5
+        db.session.commit()
+        self.assertEqual(verify_counters()['posts.comment_count'], 1)
+        rebuild_counters()
+        self.assertFalse(any(verify_counters().values()))
+        self.assertEqual(post.comment_count, 1)
+
+    def test_role_cache(self):
+        user = User(email='john@example.com', password='cat')
+        db.session.add(user)
+        db.session.commit()
+        self.assertIsNotNone(user.role_id)
+        self.assertTrue(user.can(Permission.WRITE))
+
+        # 快取暖機後不再查詢資料庫
+        before = len(get_debug_queries())
+        self.assertTrue(user.can(Permission.COMMENT))
+        self.assertFalse(user.is_administrator())
+        self.assertEqual(len(get_debug_queries()), before)
+
+        # 修改角色後快取失效
+        role = Role.query.filter_by(name='User').first()
+        role.remove_permission(Permission.WRITE)
+        db.session.commit()
+        self.assertFalse(user.can(Permission.WRITE))
+        Role.insert_roles()
+        self.assertTrue(user.can(Permission.WRITE))
+
+    def test_last_seen_buffer(self):
+        last_seen_buffer.staleness = 0
+        last_seen_buffer.flush_interval = 3600
+        user = User(password='cat')
+        db.session.add(user)
+        db.session.commit()
+        last_seen_before = user.last_seen
+        time.sleep(1)
+
+        # ping 只寫入緩衝區，等到 flush 才一次更新資料庫
+        user.ping()
+        db.session.expire(user)
+        self.assertEqual(user.last_seen, last_seen_before)
+        self.assertEqual(last_seen_buffer.flush(), 1)
+        db.session.expire(user)
+        self.assertTrue(user.last_seen > last_seen_before)
+        self.assertEqual(last_seen_buffer.flush(), 0)
+
+    def test_last_seen_background_flush(self):
+        last_seen_buffer.staleness = 0
+        last_seen_buffer.flush_interval = 0.5
+        user = User(password='cat')
+        db.session.add(user)
+        db.session.commit()
+        last_seen_before = user.last_seen
+        time.sleep(1)
+
+        # 之後沒有其他請求，背景執行緒仍會寫入
+        last_seen_buffer.flush()
+        user.ping()
+        db.session.expire(user)
+        self.assertEqual(user.last_seen, last_seen_before)
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            db.session.expire(user)
+            if user.last_seen > last_seen_before:
+                break
+            time.sleep(0.05)
+        self.assertTrue(user.last_seen > last_seen_before)
+        last_seen_buffer.shutdown()